@@ -9,38 +9,126 @@ warnings.filterwarnings('ignore')
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import threading
+import time
+import socket
+import select
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import base64
 import json
+from tracking import FaceTracker
+from detectors import DetectionStrategy, SSDDetector, HaarDetector, YuNetDetector, FaceBox, select_faces
+from encoding_cache import EncodingCache, array_digest
+from frame_context import FrameContext
+from quality import QualityGate
+from capture import CameraService
+from frame_sources import UnavailableSource, open_frame_source
+from image_io import REDUCED_DECODE_FLAGS, decode_image, image_bytes_from_base64
+from streaming import StreamSessions
+from templates import TEMPLATE_STORAGE, pack_template, unpack_template, quantized_distance, \
+    quantized_pairwise_distance, stack_templates
+try:
+    # Optional: WebSocket transport for /api/face/stream (HTTP fallback otherwise)
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    SOCK_AVAILABLE = True
+except ImportError:
+    SOCK_AVAILABLE = False
+from encoders import EncoderRegistry, FEATURE_DESCRIPTORS, DEEP_LEARNING_SIZE, \
+    feature_descriptor_size, lbp_features, compute_pairwise_distance
 
 class FaceVerificationSystem:
-    def __init__(self, data_dir='face_data', threshold=0.6):
+    def __init__(self, data_dir='face_data', threshold=0.6, descriptor='uniform', encoder=None,
+                 num_jitters=1, landmark_model='small', embedding_model=None,
+                 cache_entries=256, cache_bytes=64 * 1024 * 1024, cache_ttl=30.0,
+                 template_storage='float32', tracking=True, redetect_interval=10, roi_margin=0.5,
+                 detect_width=480, min_face_size=100, max_faces=5, detector_strategy='sequential',
+                 yunet_model=None, quality=None, capture_buffer=4, source='camera:0', source_fps=None,
+                 capture_settings=None):
+        if descriptor not in FEATURE_DESCRIPTORS:
+            raise ValueError(f"Unknown feature descriptor '{descriptor}'")
+        if template_storage not in TEMPLATE_STORAGE:
+            raise ValueError(f"Unknown template storage '{template_storage}'")
         self.data_dir = data_dir
         self.threshold = threshold
+        self.descriptor = descriptor
+        self.template_storage = template_storage
         self.known_faces = {}
         self.verification_logs = []
         
         os.makedirs(data_dir, exist_ok=True)
         
-        # Initialize camera
-        self.cap = cv2.VideoCapture(0)
+        # Initialize camera (or a video/image/synthetic stand-in, see frame_sources.py)
+        self.camera_source = str(source)
+        try:
+            self.cap = open_frame_source(source, fps=source_fps, capture=capture_settings)
+        except (ValueError, cv2.error) as e:
+            print(f"⚠ {e}")
+            self.cap = UnavailableSource(source, str(e))
         if not self.cap.isOpened():
-            print("Warning: Could not open camera. Camera functions will be disabled.")
+            print(f"Warning: Could not open frame source '{source}'. Camera functions will be disabled.")
             self.camera_available = False
         else:
             self.camera_available = True
         
+        # The camera service owns the device: its thread is the only reader,
+        # and requests/loops subscribe to its frames
+        self.camera = CameraService(self.cap, buffer_size=capture_buffer)
+        if self.camera_available:
+            self.camera.start()
+        
         # Initialize face detection
         try:
             self.face_cascade = cv2.CascadeClassifier(
                 cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
             )
-            self.cascade_loaded = True
+            self.cascade_loaded = not self.face_cascade.empty()
         except:
             print("Warning: Could not load Haar Cascade. Face detection will use DNN only.")
             self.cascade_loaded = False
         
-        # Load deep learning model if available
+        # Load deep learning models if available
         self.dnn_model = self.load_dnn_model()
+        self.yunet = self.load_yunet_model(yunet_model)
+        
+        # Detectors that loaded, and the strategy deciding which of them run per frame
+        detectors = {}
+        if self.yunet is not None:
+            detectors['yunet'] = self.yunet
+        if self.dnn_model is not None:
+            detectors['dnn'] = SSDDetector(self.dnn_model)
+        if self.cascade_loaded:
+            detectors['haar'] = HaarDetector(self.face_cascade)
+        try:
+            self.detection = DetectionStrategy(detectors, detector_strategy)
+        except ValueError as e:
+            print(f"⚠ {e}. Using sequential detection.")
+            self.detection = DetectionStrategy(detectors, 'sequential')
+        
+        # Detectors run on a proxy at most this wide (0 = full resolution)
+        self.detect_width = detect_width
+        # Faces register/verify can use: both sides > min_face_size, largest max_faces
+        self.min_face_size = min_face_size
+        self.max_faces = max_faces
+        # Blur/exposure/pose checks that reject a face before it is encoded
+        self.quality = QualityGate(min_size=min_face_size, **(quality or {}))
+        
+        # Probe encoder backends once; extract_face_encoding never re-imports them
+        self.encoders = EncoderRegistry(preferred=encoder, descriptor=descriptor,
+                                        num_jitters=num_jitters, landmark_model=landmark_model,
+                                        embedding_model=embedding_model)
+        print(f"✓ Face encoder: {self.encoders.active}")
+        
+        # Detections and encodings keyed by frame/crop content + pipeline config
+        self.cache = EncodingCache(cache_entries, cache_bytes, cache_ttl)
+        
+        # Last face box per capture source, so consecutive frames search a small ROI
+        self.tracking = tracking
+        self.tracker_config = {'redetect_interval': redetect_interval, 'roi_margin': roi_margin}
+        self.trackers = {}
+        self.trackers_lock = threading.Lock()
+        
+        # Capture/detect stage of deadline-driven verification, overlapping encoding
+        self.verify_pipeline = ThreadPoolExecutor(max_workers=4, thread_name_prefix='verify-capture')
     
     def load_dnn_model(self):
         """Load OpenCV DNN face detection model for better accuracy"""
@@ -62,173 +150,292 @@ class FaceVerificationSystem:
             print(f"⚠ Failed to load DNN model: {e}")
             return None
     
-    def detect_faces_dnn(self, frame):
+    def load_yunet_model(self, model_path=None):
+        """Load the YuNet face detector (cv2.FaceDetectorYN), which also returns landmarks"""
+        try:
+            detector = YuNetDetector(model_path)
+            print(f"✓ Loaded YuNet face detection model {detector.model_path}")
+            return detector
+        except FileNotFoundError as e:
+            print("⚠ YuNet model not found. Download it for faster detection with landmarks.")
+            print(f"   {e}")
+            return None
+        except Exception as e:
+            print(f"⚠ Failed to load YuNet model: {e}")
+            return None
+    
+    def detect_faces_dnn(self, frame, min_size=0):
         """Detect faces using DNN model"""
-        if self.dnn_model is None:
-            return []
-        
-        h, w = frame.shape[:2]
-        blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 1.0,
-                                     (300, 300), (104.0, 177.0, 123.0))
-        self.dnn_model.setInput(blob)
-        detections = self.dnn_model.forward()
-        
-        faces = []
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
-            if confidence > 0.5:  # Confidence threshold
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                x1, y1, x2, y2 = box.astype("int")
-                # Ensure coordinates are within frame
-                x1 = max(0, x1)
-                y1 = max(0, y1)
-                x2 = min(w, x2)
-                y2 = min(h, y2)
-                faces.append((x1, y1, x2-x1, y2-y1))
-        
-        return faces
+        detector = self.detection.detectors.get('dnn')
+        return detector.detect(frame, min_size) if detector else []
     
-    def detect_faces_haar(self, frame):
+    def detect_faces_haar(self, frame, min_size=(30, 30)):
         """Detect faces using Haar Cascade"""
-        if not self.cascade_loaded:
-            return []
+        detector = self.detection.detectors.get('haar')
+        return detector.detect(frame, min_size[0]) if detector else []
+    
+    def detection_config(self):
+        """Everything besides the pixels that affects detect_faces output (cache key)"""
+        return (tuple(self.detection.detectors), self.detection.strategy, self.detect_width, self.max_faces)
+    
+    def detection_proxy(self, frame):
+        """Downscaled context of the frame for the detectors, and its scale (proxy / full)"""
+        return FrameContext.of(frame).proxy(self.detect_width)
+    
+    def encoding_config(self, method=None, descriptor=None):
+        """Everything besides the pixels that affects an encoding (cache key)"""
+        encoder = self.encoders.get(method)
+        info = repr(sorted(encoder.info().items())) if encoder is not None else None
+        return (method or 'auto', info, descriptor or self.descriptor)
+    
+    def detect_faces_full(self, frame, min_size=0):
+        """Detect faces on the whole image with the configured detector strategy
         
-        try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(
-                gray, 
-                scaleFactor=1.1, 
-                minNeighbors=5,
-                minSize=(30, 30)
-            )
+        Detectors see a downscaled proxy; boxes (and landmarks, for YuNet)
+        are mapped back so callers get FaceBox (x, y, w, h) tuples in
+        full-resolution coordinates and crop from the original frame.
+        Only boxes whose sides both exceed min_size full-resolution pixels
+        are returned, largest first and at most max_faces, so callers
+        never encode faces that can't pass their size gate.
+        """
+        frame = FrameContext.of(frame)
+        proxy, scale = self.detection_proxy(frame)
+        # Proxy-space filters are one pixel lenient; the exact gate runs after mapping back
+        proxy_min = max(0, int(min_size * scale) - 1)
+        faces = self.detection.detect(proxy, proxy_min)
+        
+        if scale != 1.0:
+            height, width = frame.shape[:2]
+            faces = [face.rescaled(scale, width, height) for face in faces]
+        return select_faces(faces, min_size, top_k=self.max_faces)
+    
+    def get_tracker(self, source):
+        """Tracker for a capture source, created on first use"""
+        with self.trackers_lock:
+            if source not in self.trackers:
+                self.trackers[source] = FaceTracker(**self.tracker_config)
+            return self.trackers[source]
+    
+    def detect_faces_tracked(self, frame, source, min_size=0):
+        """Search around the source's last face; full-frame scan when the track is stale or lost"""
+        tracker = self.get_tracker(source)
+        with tracker.lock:
+            roi = tracker.search_region(frame.shape)
+            if roi is not None:
+                x0, y0, x1, y1 = roi
+                roi_frame = FrameContext(frame.image[y0:y1, x0:x1], source)
+                faces = [face.shifted(x0, y0) for face in self.detect_faces_full(roi_frame, min_size)]
+                if faces:
+                    tracker.update(faces, full_scan=False)
+                    return faces
+                tracker.miss()
+            
+            faces = self.detect_faces_full(frame, min_size)
+            tracker.update(faces, full_scan=True)
             return faces
-        except:
+    
+    def detect_faces_batch(self, frames, min_size=0):
+        """detect_faces for several unrelated frames (no tracking)
+        
+        Detectors that batch (the SSD) see all proxies in one forward pass.
+        Results are memoized in each FrameContext like detect_faces does.
+        """
+        frames = [FrameContext.of(frame) for frame in frames]
+        if not frames:
             return []
+        proxies = [frame.proxy(self.detect_width) for frame in frames]
+        # One proxy-space size filter for the batch: the most lenient; the exact gate runs after mapping
+        proxy_min = min(max(0, int(min_size * scale) - 1) for _, scale in proxies)
+        found = self.detection.detect_batch([proxy for proxy, _ in proxies], proxy_min)
+        
+        key = ('detect', None, min_size) + self.detection_config()
+        results = []
+        for frame, (_, scale), faces in zip(frames, proxies, found):
+            if scale != 1.0:
+                height, width = frame.shape[:2]
+                faces = [face.rescaled(scale, width, height) for face in faces]
+            faces = select_faces(faces, min_size, top_k=self.max_faces)
+            results.append(list(frame.memo(key, lambda faces=faces: faces)))
+        return results
+    
+    def tracking_stats(self):
+        with self.trackers_lock:
+            trackers = dict(self.trackers)
+        return {
+            'enabled': self.tracking,
+            **self.tracker_config,
+            'sources': {source: tracker.stats() for source, tracker in trackers.items()}
+        }
     
-    def detect_faces(self, frame):
-        """Detect faces using best available method"""
-        # Try DNN first
-        faces = self.detect_faces_dnn(frame)
+    def detect_faces(self, frame, source=None, min_size=0):
+        """Detect faces using best available method
         
-        # If no faces found with DNN, try Haar
-        if len(faces) == 0:
-            faces = self.detect_faces_haar(frame)
+        Frames from a live capture source (`source`) go through the tracker
+        when tracking is enabled; other frames are cached by content. `frame`
+        may be a FrameContext, in which case repeated calls for the same
+        frame reuse its detections instead of running the detectors again.
+        """
+        frame = FrameContext.of(frame, source)
+        key = ('detect', source, min_size) + self.detection_config()
+        return list(frame.memo(key, lambda: self._detect_faces(frame, source, min_size)))
+    
+    def _detect_faces(self, frame, source, min_size):
+        if source is not None and self.tracking:
+            return self.detect_faces_tracked(frame, source, min_size)
+        
+        key = None
+        if self.cache.enabled:
+            key = self.cache.key('detect', frame.digest, min_size, *self.detection_config())
+            cached = self.cache.get(key)
+            if cached is not None:
+                return list(cached)
         
+        faces = self.detect_faces_full(frame, min_size)
+        if key is not None:
+            self.cache.put(key, tuple(faces))
         return faces
     
-    def extract_face_encoding(self, face_image):
-        """Extract face encoding using deep learning or fallback"""
+    def extract_face_encoding(self, face_image, descriptor=None, method=None):
+        """Extract face encoding using the active encoder or the feature-based fallback"""
         # Ensure face image is valid
         if face_image is None or face_image.size == 0:
             return None, 'invalid'
         
-        try:
-            # Try deep learning with face_recognition
-            import face_recognition
-            rgb_image = cv2.cvtColor(face_image, cv2.COLOR_BGR2RGB)
-            encodings = face_recognition.face_encodings(rgb_image)
-            if encodings:
-                return encodings[0], 'deep_learning'
-        except ImportError:
-            pass
-        except Exception as e:
-            print(f"Deep learning encoding failed: {e}")
+        encoder = self.encoders.get(method)
+        if encoder is None:
+            return None, 'unavailable'
         
-        # Fallback to feature-based encoding
-        try:
-            face_resized = cv2.resize(face_image, (128, 128))
-            
-            # Extract multiple features
-            features = []
-            
-            # Color histogram for each channel
-            for channel in range(3):
-                hist = cv2.calcHist([face_resized], [channel], None, [32], [0, 256])
-                if hist is not None:
-                    hist = cv2.normalize(hist, hist).flatten()
-                    features.extend(hist)
-            
-            # LBP features
-            gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
-            lbp = self.extract_lbp_features(gray)
-            features.extend(lbp)
-            
-            # Edge features
-            edges = cv2.Canny(gray, 100, 200)
-            edge_hist, _ = np.histogram(edges.flatten(), bins=20, range=(0, 256))
-            edge_hist = edge_hist.astype("float")
-            if edge_hist.sum() > 0:
-                edge_hist /= edge_hist.sum()
-            features.extend(edge_hist)
-            
-            return np.array(features), 'feature_based'
-        except Exception as e:
-            print(f"Feature-based encoding failed: {e}")
-            return None, 'error'
+        key = None
+        if self.cache.enabled:
+            key = self.cache.key('encode-crop', array_digest(face_image), *self.encoding_config(method, descriptor))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        result = (None, 'error')
+        encoding = encoder.encode([face_image], descriptor=descriptor)[0]
+        if encoding is not None:
+            result = (encoding, encoder.name)
+        elif method is None and encoder is not self.encoders.fallback:
+            # Fallback to feature-based encoding unless a specific method was requested
+            encoding = self.encoders.fallback.encode([face_image], descriptor=descriptor)[0]
+            if encoding is not None:
+                result = (encoding, self.encoders.fallback.name)
+        
+        if key is not None and result[0] is not None:
+            self.cache.put(key, result)
+        return result
+    
+    def extract_face_encodings(self, frame, faces, descriptor=None, method=None):
+        """Encode all (x, y, w, h) boxes of a frame in one call, returning [(encoding, method)]
+
+        The encoder gets the full frame plus the boxes from detect_faces, so
+        it never re-detects inside a crop. Boxes the active encoder can't
+        handle fall back to feature-based unless a specific method was requested.
+        """
+        if frame is None or len(faces) == 0:
+            return []
+        
+        frame = FrameContext.of(frame)
+        # Keep FaceBox landmarks for encoders that align; plain tuples get none
+        faces = [face if isinstance(face, FaceBox) else FaceBox(face) for face in faces]
+        config = self.encoding_config(method, descriptor)
+        key = ('encode', tuple((tuple(face), face.landmarks is not None) for face in faces)) + config
+        return list(frame.memo(key, lambda: self._extract_face_encodings(frame, faces, descriptor, method, config)))
     
-    def extract_lbp_features(self, image, radius=2, points=16):
+    def _extract_face_encodings(self, frame, faces, descriptor, method, config):
+        results = [None] * len(faces)
+        keys = [None] * len(faces)
+        if self.cache.enabled:
+            digest = frame.digest
+            for i, face in enumerate(faces):
+                keys[i] = self.cache.key('encode', digest, tuple(face), face.landmarks is not None, *config)
+                results[i] = self.cache.get(keys[i])
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        
+        encoded = self.encoders.encode_frame(frame, [faces[i] for i in missing], method, descriptor=descriptor)
+        for i, (encoding, found_method) in zip(missing, encoded):
+            if encoding is None and method is None and self.encoders.get() is not self.encoders.fallback:
+                encoding = self.encoders.fallback.encode([frame.crop(faces[i])], descriptor=descriptor)[0]
+                found_method = self.encoders.fallback.name if encoding is not None else found_method
+            results[i] = (encoding, found_method)
+            if keys[i] is not None and encoding is not None:
+                self.cache.put(keys[i], results[i])
+        return results
+    
+    def extract_lbp_features(self, image, radius=2, points=16, mode='legacy'):
         """Extract Local Binary Pattern features"""
-        try:
-            height, width = image.shape
-            lbp_image = np.zeros((height-2*radius, width-2*radius), dtype=np.uint8)
-            
-            for i in range(radius, height-radius):
-                for j in range(radius, width-radius):
-                    center = image[i, j]
-                    binary_code = 0
-                    power = 0
-                    for p in range(points):
-                        angle = 2 * np.pi * p / points
-                        x = int(j + radius * np.cos(angle))
-                        y = int(i - radius * np.sin(angle))
-                        if x >= 0 and x < width and y >= 0 and y < height:
-                            binary_code |= (image[y, x] >= center) << power
-                        power += 1
-                    lbp_image[i-radius, j-radius] = binary_code
-            
-            # Histogram of LBP
-            hist, _ = np.histogram(lbp_image.ravel(), bins=256, range=(0, 256))
-            hist = hist.astype("float")
-            if hist.sum() > 0:
-                hist /= hist.sum()
-            return hist
-        except:
-            return np.zeros(256)
+        return lbp_features(image, radius, points, mode)
     
-    def compare_faces(self, encoding1, encoding2, method='deep_learning'):
-        """Compare two face encodings"""
+    def compare_faces(self, encoding1, encoding2, method='deep_learning', descriptor=None):
+        """Compare a face encoding against one encoding, or each row of a (N, D) gallery"""
         if encoding1 is None or encoding2 is None:
             return float('inf')
         
+        encoder = self.encoders.get(method)
+        if encoder is None:
+            return float('inf')
+        
         try:
-            if method == 'deep_learning':
-                # Cosine distance for deep learning encodings
-                return np.linalg.norm(encoding1 - encoding2)
-            else:
-                # Weighted Euclidean distance for feature-based
-                weights = np.ones_like(encoding1)
-                if len(weights) > 96:  # If we have LBP features
-                    weights[96:] = 2.0  # Double weight for LBP features
-                weighted_diff = weights * (encoding1 - encoding2)
-                return np.sqrt(np.sum(weighted_diff ** 2))
+            return encoder.distance(encoding1, encoding2, descriptor)
         except:
             return float('inf')
     
-    def capture_frame(self):
-        """Capture a single frame from camera"""
-        if not self.camera_available:
-            return None
+    def template_weights(self, method, descriptor=None):
+        """Per-dimension metric weights for a template (None when unweighted)"""
+        encoder = self.encoders.get(method)
+        return encoder.metric_params(descriptor)[1] if encoder is not None else None
+    
+    def match_threshold(self, user_data):
+        """Verification threshold for a template, scaled to its backend's distance range"""
+        encoder = self.encoders.get(user_data['method'])
+        scale = encoder.threshold_scale(user_data.get('descriptor')) if encoder is not None else 1.0
+        return self.threshold * scale
+    
+    def compare_template(self, encoding, user_data):
+        """Distance (a plain float) from a probe encoding to a stored template; int8 templates are never dequantized"""
+        if encoding is None:
+            return float('inf')
+        
+        encoder = self.encoders.get(user_data['method'])
+        if encoder is None:
+            return float('inf')
         
+        descriptor = user_data.get('descriptor')
         try:
-            ret, frame = self.cap.read()
-            if ret:
-                return frame
-            return None
+            if user_data.get('storage') == 'int8':
+                metric, weights, cells = encoder.metric_params(descriptor)
+                return float(quantized_distance(
+                    metric, encoding, user_data['encoding'], user_data['scale'],
+                    user_data['offset'], user_data['sq_norm'], weights, cells
+                ))
+            return float(encoder.distance(encoding, user_data['encoding'], descriptor))
         except:
+            return float('inf')
+    
+    def capture_frame(self, newer_than=None, timeout=1.0):
+        """Freshest frame from the camera service
+        
+        Returns immediately once the service has a frame; only waits (up to
+        timeout) right after startup, or for a frame newer than the
+        `newer_than` timestamp when one is given.
+        """
+        if not self.camera_available:
             return None
+        
+        frame, _ = self.camera.read(newer_than, timeout)
+        return frame
     
-    def register_user(self, username, num_samples=3):
-        """Register a new user without GUI windows"""
+    def register_user(self, username, num_samples=3, timeout=30.0, sample_gap=0.5):
+        """Register a new user without GUI windows
+        
+        Each iteration handles the next new camera frame; samples are taken
+        from frames at least sample_gap seconds apart, so the template
+        averages distinct views rather than near-identical frames.
+        """
         print(f"Registering user: {username}")
         
         if not self.camera_available:
@@ -237,78 +444,267 @@ class FaceVerificationSystem:
         
         samples = []
         sample_count = 0
-        start_time = datetime.now()
+        deadline = time.monotonic() + timeout
+        last_sample_ts = None
         
         print("Look at the camera. Capturing samples...")
         
-        while sample_count < num_samples:
-            # Check timeout (30 seconds)
-            if (datetime.now() - start_time).seconds > 30:
-                print("Registration timeout (30 seconds)")
-                return False
-            
-            frame = self.capture_frame()
+        with self.camera.subscribe('register') as feed:
+            while sample_count < num_samples:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Registration timeout ({timeout:.0f} seconds)")
+                    return False
+                
+                after = last_sample_ts + sample_gap if last_sample_ts is not None and sample_gap > 0 else None
+                frame, ts = feed.next(min(1.0, remaining), after=after)
+                if frame is None:
+                    continue
+                frame = FrameContext(frame, self.camera_source)
+                
+                faces = self.detect_faces(frame, source=self.camera_source, min_size=self.min_face_size)
+                
+                if len(faces) > 0:
+                    face = frame.crop(faces[0])
+                    
+                    if face.size > 0:
+                        # Ensure face is reasonably sized, lit, sharp and frontal (detections come largest first)
+                        passed, reason, _ = self.quality.check(frame, faces[0])
+                        if passed:
+                            encoding, method = self.extract_face_encodings(frame, faces[:1])[0]
+                            if encoding is not None:
+                                samples.append((encoding, method))
+                                sample_count += 1
+                                last_sample_ts = ts
+                                print(f"✓ Captured sample {sample_count}/{num_samples}")
+                        elif reason == 'too_small':
+                            print("⚠ Face too small. Move closer to camera.")
+                        else:
+                            print(f"⚠ Face rejected ({reason}). Hold still in good light, facing the camera.")
+                else:
+                    print("⚠ No face detected. Look directly at camera.")
+        
+        if self.store_template(username, samples):
+            return True
+        
+        print("✗ No valid faces detected during registration")
+        return False
+    
+    def store_template(self, username, samples):
+        """Average [(encoding, method)] samples into the user's stored template
+        
+        Samples are grouped by method, preferring the active encoder's.
+        Returns False when there are no samples.
+        """
+        if not samples:
+            return False
+        
+        by_method = {}
+        for e, m in samples:
+            by_method.setdefault(m, []).append(e)
+        method = self.encoders.active if self.encoders.active in by_method else next(iter(by_method))
+        avg_encoding = np.mean(by_method[method], axis=0)
+        descriptor = self.descriptor if method == 'feature_based' else None
+        
+        entry = {
+            'method': method,
+            'samples': len(samples),
+            'registered': datetime.now().isoformat()
+        }
+        if descriptor:
+            entry['descriptor'] = descriptor
+        entry.update(pack_template(avg_encoding, self.template_storage,
+                                   self.template_weights(method, descriptor)))
+        self.known_faces[username] = entry
+        
+        self.save_data()
+        print(f"✓ User '{username}' registered successfully!")
+        
+        # Log registration
+        self.log_verification(username, 'registration', True, {'samples': len(samples)})
+        return True
+    
+    def verify_frames_batch(self, items, min_size=None):
+        """Verify many (username, frame) pairs together
+        
+        Detection runs over all frames at once, the largest face of each
+        frame that passes the quality gate is encoded in one call per
+        template method, and each group is compared against its users'
+        templates in one vectorized pass. Items with frame None are skipped
+        (the caller reports why). Returns (per-item result dicts in input
+        order, batch stage times in ms).
+        """
+        min_size = self.min_face_size if min_size is None else min_size
+        stages = {'detect_ms': 0.0, 'quality_ms': 0.0, 'encode_ms': 0.0, 'compare_ms': 0.0}
+        results = [{'verified': False, 'distance': None, 'faces_detected': 0} for _ in items]
+        
+        pending = []
+        for i, (username, frame) in enumerate(items):
             if frame is None:
                 continue
-            
-            faces = self.detect_faces(frame)
-            
-            if len(faces) > 0:
-                x, y, w, h = faces[0]
-                face = frame[y:y+h, x:x+w]
-                
-                if face.size > 0:
-                    # Ensure face is reasonably sized
-                    if w > 100 and h > 100:
-                        encoding, method = self.extract_face_encoding(face)
-                        if encoding is not None:
-                            samples.append((encoding, method))
-                            sample_count += 1
-                            print(f"✓ Captured sample {sample_count}/{num_samples}")
-                            
-                            # Wait a moment between samples
-                            import time
-                            time.sleep(0.5)
-                    else:
-                        print("⚠ Face too small. Move closer to camera.")
+            user_data = self.known_faces.get(username)
+            if user_data is None:
+                results[i]['outcome'] = 'not_registered'
+            elif self.encoders.get(user_data['method']) is None:
+                results[i]['outcome'] = 'encoder_unavailable'
             else:
-                print("⚠ No face detected. Look directly at camera.")
-            
-            # Small delay
-            import time
-            time.sleep(0.1)
-        
-        if samples:
-            # Separate encodings by method
-            deep_learning_samples = [e for e, m in samples if m == 'deep_learning']
-            feature_samples = [e for e, m in samples if m == 'feature_based']
-            
-            if deep_learning_samples:
-                avg_encoding = np.mean(deep_learning_samples, axis=0)
-                method = 'deep_learning'
-            elif feature_samples:
-                avg_encoding = np.mean(feature_samples, axis=0)
-                method = 'feature_based'
+                pending.append(i)
+        
+        frames = {i: FrameContext.of(items[i][1]) for i in pending}
+        start = time.perf_counter()
+        detected = self.detect_faces_batch([frames[i] for i in pending], min_size)
+        stages['detect_ms'] = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        chosen = {}
+        for i, faces in zip(pending, detected):
+            results[i]['faces_detected'] = len(faces)
+            passing = [face for face in faces if self.quality.check(frames[i], face, min_size)[0]]
+            if not faces:
+                results[i]['outcome'] = 'no_face'
+            elif not passing:
+                results[i]['outcome'] = 'low_quality'
             else:
-                print("No valid samples collected")
-                return False
-            
-            self.known_faces[username] = {
-                'encoding': avg_encoding,
-                'method': method,
-                'samples': len(samples),
-                'registered': datetime.now().isoformat()
-            }
-            
-            self.save_data()
-            print(f"✓ User '{username}' registered successfully!")
+                chosen[i] = passing[0]
+        stages['quality_ms'] = (time.perf_counter() - start) * 1000
+        
+        # Group by template backend so each group is one encode and one compare call
+        groups = {}
+        for i in chosen:
+            user_data = self.known_faces[items[i][0]]
+            groups.setdefault((user_data['method'], user_data.get('descriptor')), []).append(i)
+        
+        for (method, descriptor), indices in groups.items():
+            start = time.perf_counter()
+            encoded = self.encoders.encode_faces([(frames[i], chosen[i]) for i in indices],
+                                                 method, descriptor=descriptor)
+            stages['encode_ms'] += (time.perf_counter() - start) * 1000
             
-            # Log registration
-            self.log_verification(username, 'registration', True, {'samples': len(samples)})
-            return True
+            start = time.perf_counter()
+            ok = [(i, encoding) for i, (encoding, _) in zip(indices, encoded) if encoding is not None]
+            for i, (encoding, _) in zip(indices, encoded):
+                if encoding is None:
+                    results[i]['outcome'] = 'encoding_failed'
+            if ok:
+                metric, weights, cells = self.encoders.get(method).metric_params(descriptor)
+                threshold = self.match_threshold(self.known_faces[items[ok[0][0]][0]])
+                # int8 templates are compared on their quantized form, the rest in float
+                quantized = [(i, e) for i, e in ok if self.known_faces[items[i][0]].get('storage') == 'int8']
+                floating = [(i, e) for i, e in ok if self.known_faces[items[i][0]].get('storage') != 'int8']
+                compared = []
+                if quantized:
+                    probes = np.stack([encoding for _, encoding in quantized])
+                    stacked = stack_templates([self.known_faces[items[i][0]] for i, _ in quantized])
+                    compared.append((quantized, quantized_pairwise_distance(metric, probes, *stacked, weights, cells)))
+                if floating:
+                    probes = np.stack([encoding for _, encoding in floating])
+                    templates = np.stack([unpack_template(self.known_faces[items[i][0]]) for i, _ in floating])
+                    compared.append((floating, compute_pairwise_distance(metric, probes, templates, cells)))
+                for entries, distances in compared:
+                    for (i, _), distance in zip(entries, distances):
+                        verified = bool(distance < threshold)
+                        results[i].update({'verified': verified, 'distance': float(distance),
+                                           'outcome': 'match' if verified else 'no_match'})
+            stages['compare_ms'] += (time.perf_counter() - start) * 1000
         
-        print("✗ No valid faces detected during registration")
-        return False
+        for i in pending:
+            self.log_verification(items[i][0], 'batch_verification', results[i]['verified'], {
+                'distance': results[i]['distance'], 'outcome': results[i].get('outcome')
+            })
+        return results, {name: round(ms, 3) for name, ms in stages.items()}
+    
+    def register_frames(self, username, frames, min_size=None):
+        """Register a user from still images (e.g. uploads) instead of the server camera
+        
+        The largest face of each frame that passes the quality gate becomes
+        one sample. Returns a dict with registered, samples and, per frame,
+        None or the reason it gave no sample.
+        """
+        min_size = self.min_face_size if min_size is None else min_size
+        samples = []
+        rejected = []
+        for frame in frames:
+            frame = FrameContext.of(frame)
+            faces = self.detect_faces(frame, min_size=min_size)
+            if not faces:
+                rejected.append('no_face')
+                continue
+            passed, reason, _ = self.quality.check(frame, faces[0], min_size)
+            if not passed:
+                rejected.append(reason)
+                continue
+            encoding, method = self.extract_face_encodings(frame, faces[:1])[0]
+            if encoding is None:
+                rejected.append('encoding_failed')
+                continue
+            samples.append((encoding, method))
+            rejected.append(None)
+        
+        registered = self.store_template(username, samples)
+        return {'registered': registered, 'samples': len(samples), 'rejected': rejected}
+    
+    def verify_frame(self, username, frame, min_size=None, log=True):
+        """Verify a user against one still image (e.g. an upload), without the server camera
+        
+        Runs the same detect -> quality -> encode -> compare pipeline as
+        verify_user, stopping at the first face below the threshold.
+        Returns a dict with verified, distance, outcome ('match', 'no_match',
+        'no_face', 'low_quality' or an error), face counts and stage times in ms.
+        """
+        min_size = self.min_face_size if min_size is None else min_size
+        stages = {'detect_ms': 0.0, 'quality_ms': 0.0, 'encode_ms': 0.0, 'compare_ms': 0.0}
+        result = {'verified': False, 'distance': None, 'faces_detected': 0, 'faces_checked': 0}
+        
+        def finish(outcome):
+            result['outcome'] = outcome
+            result['stages'] = {name: round(ms, 3) for name, ms in stages.items()}
+            if log and outcome in ('match', 'no_match', 'no_face', 'low_quality'):
+                self.log_verification(username, 'image_verification', result['verified'], {
+                    'distance': result['distance'], 'outcome': outcome
+                })
+            return result
+        
+        user_data = self.known_faces.get(username)
+        if user_data is None:
+            return finish('not_registered')
+        method = user_data['method']
+        descriptor = user_data.get('descriptor')
+        if self.encoders.get(method) is None:
+            return finish('encoder_unavailable')
+        threshold = self.match_threshold(user_data)
+        
+        frame = FrameContext.of(frame)
+        start = time.perf_counter()
+        faces = self.detect_faces(frame, min_size=min_size)
+        stages['detect_ms'] = (time.perf_counter() - start) * 1000
+        result['faces_detected'] = len(faces)
+        if not faces:
+            return finish('no_face')
+        
+        start = time.perf_counter()
+        candidates = [face for face in faces if self.quality.check(frame, face, min_size)[0]]
+        stages['quality_ms'] = (time.perf_counter() - start) * 1000
+        if not candidates:
+            return finish('low_quality')
+        
+        best_distance = float('inf')
+        # Largest face first; the rest in one batch only if it didn't match
+        for batch in (candidates[:1], candidates[1:]):
+            if not batch or best_distance < threshold:
+                continue
+            start = time.perf_counter()
+            encoded = self.extract_face_encodings(frame, batch, descriptor, method)
+            stages['encode_ms'] += (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            for encoding, _ in encoded:
+                if encoding is not None:
+                    result['faces_checked'] += 1
+                    best_distance = min(best_distance, self.compare_template(encoding, user_data))
+            stages['compare_ms'] += (time.perf_counter() - start) * 1000
+        
+        result['distance'] = float(best_distance) if best_distance != float('inf') else None
+        result['verified'] = bool(best_distance < threshold)
+        return finish('match' if result['verified'] else 'no_match')
     
     def verify_user(self, username, max_attempts=3):
         """Verify user identity without GUI windows"""
@@ -321,54 +717,185 @@ class FaceVerificationSystem:
             return False
         
         user_data = self.known_faces[username]
-        registered_encoding = user_data['encoding']
         method = user_data['method']
+        descriptor = user_data.get('descriptor')
+        
+        if self.encoders.get(method) is None:
+            print(f"Encoder '{method}' used at registration is not available")
+            return False
+        threshold = self.match_threshold(user_data)
         
         print(f"Verifying user: {username}")
         
-        for attempt in range(max_attempts):
-            print(f"Attempt {attempt + 1}/{max_attempts}")
-            
-            frame = self.capture_frame()
-            if frame is None:
-                print("Could not capture frame")
-                continue
-            
-            faces = self.detect_faces(frame)
-            best_distance = float('inf')
-            
-            for (x, y, w, h) in faces:
-                face = frame[y:y+h, x:x+w]
-                if face.size > 0 and w > 100 and h > 100:
-                    encoding, detected_method = self.extract_face_encoding(face)
+        with self.camera.subscribe('verify') as feed:
+            for attempt in range(max_attempts):
+                print(f"Attempt {attempt + 1}/{max_attempts}")
+                
+                # Every attempt looks at a new frame, as soon as the camera delivers it
+                frame, _ = feed.next()
+                if frame is None:
+                    print("Could not capture frame")
+                    continue
+                frame = FrameContext(frame, self.camera_source)
+                
+                # Only faces that pass the size gate come back from the detector
+                faces = self.detect_faces(frame, source=self.camera_source, min_size=self.min_face_size)
+                best_distance = float('inf')
+                
+                candidates = [face for face in faces
+                              if frame.crop(face).size > 0 and self.quality.check(frame, face)[0]]
+                
+                # Encode all candidates in one call with the template's backend
+                for encoding, _ in self.extract_face_encodings(frame, candidates, descriptor, method):
                     if encoding is not None:
-                        # Use appropriate comparison method
-                        if method == detected_method:
-                            distance = self.compare_faces(encoding, registered_encoding, method)
-                        else:
-                            # If methods don't match, use feature-based
-                            distance = self.compare_faces(encoding, registered_encoding, 'feature_based')
+                        distance = self.compare_template(encoding, user_data)
                         
                         best_distance = min(best_distance, distance)
                         
                         print(f"  Face detected, distance: {distance:.4f}")
-            
-            # Check verification
-            if best_distance < self.threshold:
-                print(f"✓ Verification successful! Distance: {best_distance:.4f}")
-                self.log_verification(username, 'verification', True, {'distance': best_distance})
-                return True
-            else:
-                print(f"✗ Verification failed. Best distance: {best_distance:.4f} (threshold: {self.threshold})")
-            
-            # Small delay between attempts
-            import time
-            time.sleep(0.5)
+                
+                # Check verification
+                if best_distance < threshold:
+                    print(f"✓ Verification successful! Distance: {best_distance:.4f}")
+                    self.log_verification(username, 'verification', True, {'distance': best_distance})
+                    return True
+                else:
+                    print(f"✗ Verification failed. Best distance: {best_distance:.4f} (threshold: {threshold:.4f})")
         
         print("✗ All verification attempts failed")
         self.log_verification(username, 'verification', False, {'attempts': max_attempts})
         return False
     
+    def prepare_verification_frame(self, feed, timeout, stop):
+        """Capture, detect and quality-gate the next frame: the stage that overlaps encoding
+        
+        Returns (frame, timestamp, candidate faces, stage timings in ms), or
+        (None, ...) when no frame arrived in time or `stop` was set meanwhile.
+        """
+        timings = {}
+        start = time.perf_counter()
+        frame, ts = feed.next(timeout, stop)
+        timings['capture_ms'] = (time.perf_counter() - start) * 1000
+        if frame is None or stop.is_set():
+            return None, ts, [], timings
+        
+        frame = FrameContext(frame, self.camera_source)
+        start = time.perf_counter()
+        faces = self.detect_faces(frame, source=self.camera_source, min_size=self.min_face_size)
+        timings['detect_ms'] = (time.perf_counter() - start) * 1000
+        if stop.is_set():
+            return None, ts, [], timings
+        
+        start = time.perf_counter()
+        candidates = [face for face in faces
+                      if frame.crop(face).size > 0 and self.quality.check(frame, face)[0]]
+        timings['quality_ms'] = (time.perf_counter() - start) * 1000
+        return frame, ts, candidates, timings
+    
+    def verify_user_deadline(self, username, deadline_ms=1500, cancelled=None):
+        """Verify within a latency budget instead of a fixed number of attempts
+        
+        Capture and detection of frame N+1 run on a worker thread while frame
+        N is encoded and compared. The largest face is encoded first, so a
+        match stops before any other face is encoded. Work still in flight
+        is abandoned as soon as there is a match, the deadline passes or
+        `cancelled()` (e.g. the HTTP client went away) returns true.
+        
+        Returns a dict with verified, distance, outcome ('match', 'deadline',
+        'cancelled' or an error), attempts and per-stage times in ms.
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + deadline_ms / 1000.0
+        stages = {'capture_ms': 0.0, 'detect_ms': 0.0, 'quality_ms': 0.0, 'encode_ms': 0.0, 'compare_ms': 0.0}
+        result = {'verified': False, 'distance': None, 'attempts': 0, 'deadline_ms': deadline_ms}
+        
+        def finish(outcome):
+            result['outcome'] = outcome
+            result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            result['stages'] = {name: round(ms, 3) for name, ms in stages.items()}
+            return result
+        
+        if username not in self.known_faces:
+            return finish('not_registered')
+        if not self.camera_available:
+            return finish('camera_unavailable')
+        user_data = self.known_faces[username]
+        method = user_data['method']
+        descriptor = user_data.get('descriptor')
+        if self.encoders.get(method) is None:
+            return finish('encoder_unavailable')
+        threshold = self.match_threshold(user_data)
+        
+        stop = threading.Event()
+        best_distance = float('inf')
+        outcome = 'deadline'
+        # One cursor for the whole call: each pipeline stage gets the next unseen frame
+        feed = self.camera.subscribe('verify')
+        pending = self.verify_pipeline.submit(self.prepare_verification_frame, feed,
+                                              max(0.0, deadline - time.monotonic()), stop)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if cancelled is not None and cancelled():
+                    outcome = 'cancelled'
+                    break
+                try:
+                    # Short waits so a disconnect is noticed while the camera is slow
+                    frame, _, candidates, timings = pending.result(timeout=min(remaining, 0.1))
+                except FutureTimeout:
+                    continue
+                except Exception as e:
+                    print(f"⚠ Verification frame failed: {e}")
+                    frame, _, candidates, timings = None, None, [], {}
+                for name, ms in timings.items():
+                    stages[name] += ms
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Start on the next frame before encoding this one
+                pending = self.verify_pipeline.submit(self.prepare_verification_frame, feed,
+                                                      remaining, stop)
+                if frame is None:
+                    continue
+                result['attempts'] += 1
+                
+                # Largest face first; the rest in one batch only if it didn't match
+                for batch in (candidates[:1], candidates[1:]):
+                    if not batch or best_distance < threshold:
+                        continue
+                    start = time.perf_counter()
+                    encoded = self.extract_face_encodings(frame, batch, descriptor, method)
+                    stages['encode_ms'] += (time.perf_counter() - start) * 1000
+                    start = time.perf_counter()
+                    for encoding, _ in encoded:
+                        if encoding is not None:
+                            best_distance = min(best_distance, self.compare_template(encoding, user_data))
+                    stages['compare_ms'] += (time.perf_counter() - start) * 1000
+                
+                if best_distance < threshold:
+                    outcome = 'match'
+                    break
+        finally:
+            # Abandon the in-flight capture/detect; its result is never used
+            stop.set()
+            pending.cancel()
+            feed.close()
+        
+        result['verified'] = outcome == 'match'
+        result['distance'] = float(best_distance) if best_distance != float('inf') else None
+        self.log_verification(username, 'verification', result['verified'], {
+            'distance': result['distance'], 'attempts': result['attempts'],
+            'deadline_ms': deadline_ms, 'outcome': outcome
+        })
+        if result['verified']:
+            print(f"✓ Verification successful! Distance: {best_distance:.4f} ({result['attempts']} frames)")
+        else:
+            print(f"✗ Verification {outcome} after {result['attempts']} frames")
+        return finish(outcome)
+    
     def log_verification(self, username, action, success, details=None):
         """Log verification events"""
         log_entry = {
@@ -436,7 +963,15 @@ class FaceVerificationSystem:
         if os.path.exists(data_file):
             try:
                 with open(data_file, 'rb') as f:
-                    self.known_faces = pickle.load(f)
+                    stored = pickle.load(f)
+                self.known_faces = {}
+                for username, entry in stored.items():
+                    migrated = self.migrate_face_entry(entry)
+                    if migrated is None:
+                        size = np.asarray(entry.get('encoding')).size
+                        print(f"⚠ Skipping '{username}': unrecognized encoding ({size} values). User must re-register.")
+                        continue
+                    self.known_faces[username] = migrated
                 print(f"✓ Loaded face data for {len(self.known_faces)} users")
                 return True
             except Exception as e:
@@ -444,14 +979,55 @@ class FaceVerificationSystem:
                 self.known_faces = {}
         return False
     
+    def migrate_face_entry(self, entry):
+        """Fill in method/descriptor for templates saved by older versions, or None if unusable"""
+        encoding = entry.get('encoding')
+        if encoding is None:
+            return None
+        
+        size = np.asarray(encoding).size
+        method = entry.get('method')
+        if method is None:
+            method = 'deep_learning' if size == DEEP_LEARNING_SIZE else 'feature_based'
+        
+        if method == 'feature_based':
+            descriptor = entry.get('descriptor')
+            if descriptor is None:
+                # Templates from before descriptor modes existed are identified by size
+                matches = [d for d in FEATURE_DESCRIPTORS if feature_descriptor_size(d) == size]
+                descriptor = matches[0] if matches else None
+            if descriptor not in FEATURE_DESCRIPTORS or feature_descriptor_size(descriptor) != size:
+                return None
+            entry['descriptor'] = descriptor
+        else:
+            # Other backends: check the size against the loaded encoder when we can
+            encoder = self.encoders.get(method)
+            expected = encoder.dim if encoder is not None else None
+            if expected is None and method == 'deep_learning':
+                expected = DEEP_LEARNING_SIZE
+            if expected is not None and size != expected:
+                return None
+        
+        entry['method'] = method
+        
+        # Re-store in the configured compact format; the next save_data persists it
+        if entry.get('storage', 'float64') != self.template_storage:
+            encoding = unpack_template(entry) if entry.get('storage') == 'int8' else entry['encoding']
+            for key in ('scale', 'offset', 'sq_norm'):
+                entry.pop(key, None)
+            entry.update(pack_template(encoding, self.template_storage,
+                                       self.template_weights(method, entry.get('descriptor'))))
+        return entry
+    
     def test_camera(self):
-        """Test if camera is working"""
+        """Test if camera is working; returns the frame as a FrameContext holding its detections"""
         if not self.camera_available:
             return None, "Camera not available"
         
         try:
-            ret, frame = self.cap.read()
-            if ret:
+            frame = self.capture_frame()
+            if frame is not None:
+                frame = FrameContext(frame)
                 faces = self.detect_faces(frame)
                 return frame, f"Camera working. Detected {len(faces)} faces."
             else:
@@ -465,8 +1041,8 @@ class FaceVerificationSystem:
             return None
         
         try:
-            ret, frame = self.cap.read()
-            if ret:
+            frame = self.capture_frame()
+            if frame is not None:
                 # Convert to base64
                 _, buffer = cv2.imencode('.jpg', frame)
                 img_str = base64.b64encode(buffer).decode('utf-8')
@@ -477,9 +1053,71 @@ class FaceVerificationSystem:
 
 # Flask Application
 app = Flask(__name__)
+# Uploaded images (verify-image/register-image) beyond this get a 413
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('FACE_MAX_UPLOAD_MB', 16)) * 1024 * 1024)
 CORS(app)
 
-face_system = FaceVerificationSystem(threshold=0.55)
+face_system = FaceVerificationSystem(
+    threshold=0.55,
+    descriptor=os.environ.get('FACE_DESCRIPTOR', 'uniform'),
+    encoder=os.environ.get('FACE_ENCODER'),
+    num_jitters=int(os.environ.get('FACE_NUM_JITTERS', 1)),
+    landmark_model=os.environ.get('FACE_LANDMARK_MODEL', 'small'),
+    embedding_model=os.environ.get('FACE_EMBEDDING_MODEL'),
+    cache_entries=int(os.environ.get('FACE_CACHE_ENTRIES', 256)),
+    cache_bytes=int(float(os.environ.get('FACE_CACHE_MB', 64)) * 1024 * 1024),
+    cache_ttl=float(os.environ.get('FACE_CACHE_TTL', 30)),
+    template_storage=os.environ.get('FACE_TEMPLATE_STORAGE', 'float32'),
+    tracking=os.environ.get('FACE_TRACKING', '1') != '0',
+    redetect_interval=int(os.environ.get('FACE_REDETECT_INTERVAL', 10)),
+    detect_width=int(os.environ.get('FACE_DETECT_WIDTH', 480)),
+    max_faces=int(os.environ.get('FACE_MAX_FACES', 5)),
+    detector_strategy=os.environ.get('FACE_DETECTOR_STRATEGY', 'sequential'),
+    yunet_model=os.environ.get('FACE_YUNET_MODEL'),
+    capture_buffer=int(os.environ.get('FACE_CAPTURE_BUFFER', 4)),
+    source=os.environ.get('FACE_SOURCE', 'camera:0'),
+    source_fps=float(os.environ['FACE_SOURCE_FPS']) if os.environ.get('FACE_SOURCE_FPS') else None,
+    # Camera mode requested at open time; 0 or empty leaves a property at the driver default
+    capture_settings={
+        'width': int(os.environ.get('FACE_CAPTURE_WIDTH', 1280)),
+        'height': int(os.environ.get('FACE_CAPTURE_HEIGHT', 720)),
+        'fourcc': os.environ.get('FACE_CAPTURE_FOURCC', 'MJPG') or None,
+        'fps': float(os.environ.get('FACE_CAPTURE_FPS', 30)),
+        'buffer_size': int(os.environ.get('FACE_CAPTURE_DRIVER_BUFFER', 1))
+    },
+    quality={
+        'enabled': os.environ.get('FACE_QUALITY', '1') != '0',
+        'min_sharpness': float(os.environ.get('FACE_MIN_SHARPNESS', 40)),
+        'min_brightness': float(os.environ.get('FACE_MIN_BRIGHTNESS', 40)),
+        'max_brightness': float(os.environ.get('FACE_MAX_BRIGHTNESS', 215)),
+        'min_contrast': float(os.environ.get('FACE_MIN_CONTRAST', 20)),
+        'max_yaw': float(os.environ.get('FACE_MAX_YAW', 0.3))
+    }
+)
+
+# Upper bound on a client-supplied verify deadline_ms, so no request holds the camera loop indefinitely
+VERIFY_MAX_DEADLINE_MS = float(os.environ.get('FACE_VERIFY_MAX_DEADLINE_MS', 30000))
+
+def client_disconnected(environ):
+    """Callable telling whether the HTTP client has closed its connection
+    
+    Peeks at the request socket the Werkzeug server exposes: readable with
+    no data means the peer hung up. Under servers that don't expose the
+    socket it always returns False.
+    """
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        return lambda: False
+    
+    def check():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError) as e:
+            # A closed or reset socket fails here too; anything else is worth seeing
+            print(f"⚠ Could not check client connection, treating it as closed: {e}")
+            return True
+    return check
 
 @app.route('/api/face/status', methods=['GET'])
 def system_status():
@@ -489,7 +1127,18 @@ def system_status():
         'status': 'running',
         'registered_users': len(face_system.known_faces),
         'threshold': face_system.threshold,
+        'descriptor': face_system.descriptor,
+        'template_storage': face_system.template_storage,
+        'encoder': face_system.encoders.status(),
+        'cache': face_system.cache.stats(),
+        'tracking': face_system.tracking_stats(),
+        'detection': face_system.detection.stats(),
+        'detect_width': face_system.detect_width,
+        'quality': face_system.quality.stats(),
+        'capture': face_system.camera.stats(),
+        'streams': {**stream_sessions.stats(), 'websocket': SOCK_AVAILABLE},
         'using_dnn': face_system.dnn_model is not None,
+        'using_yunet': face_system.yunet is not None,
         'camera_available': face_system.camera_available,
         'cascade_loaded': face_system.cascade_loaded
     })
@@ -551,6 +1200,23 @@ def verify_face():
             'error': 'Camera not available. Please check camera connection.'
         }), 503
     
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None:
+        # Latency budget instead of attempts; stops early when the client disconnects
+        try:
+            deadline_ms = min(VERIFY_MAX_DEADLINE_MS, max(1.0, float(deadline_ms)))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'deadline_ms must be a number'}), 400
+        result = face_system.verify_user_deadline(username, deadline_ms,
+                                                  cancelled=client_disconnected(request.environ))
+        verified = result['verified']
+        return jsonify({
+            'success': verified,
+            'username': username,
+            'message': 'Identity verified successfully' if verified else 'Verification failed',
+            **result
+        })
+    
     verified = face_system.verify_user(username, max_attempts=3)
     
     return jsonify({
@@ -560,6 +1226,345 @@ def verify_face():
         'message': 'Identity verified successfully' if verified else 'Verification failed'
     })
 
+def request_field(name, default=None):
+    """A parameter from the form, the JSON body or the query string"""
+    if name in request.form:
+        return request.form[name]
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict) and name in data:
+        return data[name]
+    return request.args.get(name, default)
+
+def request_image_bytes():
+    """Encoded images of a request: multipart files, base64 JSON fields or the raw body"""
+    if request.files:
+        return [f.read() for key in ('image', 'images') for f in request.files.getlist(key)]
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        images = data.get('images') or ([data['image']] if data.get('image') else [])
+        return [image_bytes_from_base64(image) for image in images]
+    body = request.get_data(cache=False)
+    return [body] if body else []
+
+def request_username():
+    """The 'username' parameter, or None when it is missing or not a string"""
+    username = request_field('username')
+    return username if isinstance(username, str) and username else None
+
+def request_reduce():
+    """IMREAD_REDUCED_* factor from the 'reduce' parameter (1 = full-resolution decode)"""
+    try:
+        reduce = int(request_field('reduce', 1))
+    except (TypeError, ValueError):
+        raise ValueError(f"reduce must be one of {sorted(REDUCED_DECODE_FLAGS)}")
+    if reduce not in REDUCED_DECODE_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(REDUCED_DECODE_FLAGS)}")
+    return reduce
+
+def decode_request_images():
+    """(frames, reduce, decode ms) for the request, or raise ValueError with a client error"""
+    reduce = request_reduce()
+    try:
+        payloads = request_image_bytes()
+    except (ValueError, TypeError):
+        raise ValueError('Image is not valid base64')
+    if not payloads:
+        raise ValueError('Image is required (multipart "image", JSON base64 "image" or raw body)')
+    
+    start = time.perf_counter()
+    frames = [decode_image(data, reduce) for data in payloads]
+    decode_ms = (time.perf_counter() - start) * 1000
+    if any(frame is None for frame in frames):
+        raise ValueError('Could not decode image')
+    return frames, reduce, decode_ms
+
+@app.route('/api/face/verify-image', methods=['POST'])
+def verify_image():
+    """Verify a user's face from one uploaded image instead of the server camera"""
+    username = request_username()
+    if not username:
+        return jsonify({'success': False, 'error': 'Username is required'}), 400
+    if username not in face_system.known_faces:
+        return jsonify({'success': False, 'error': 'User not registered'}), 404
+    
+    try:
+        frames, reduce, decode_ms = decode_request_images()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if len(frames) > 1:
+        return jsonify({
+            'success': False,
+            'error': f'Expected one image, got {len(frames)}; use /api/face/verify-batch for several'
+        }), 400
+    
+    # The size gate is in full-resolution pixels; reduced decodes shrink faces too
+    result = face_system.verify_frame(username, frames[0], min_size=face_system.min_face_size // reduce)
+    result['stages'] = {'decode_ms': round(decode_ms, 3), **result['stages']}
+    verified = result['verified']
+    return jsonify({
+        'success': verified,
+        'username': username,
+        'message': 'Identity verified successfully' if verified else 'Verification failed',
+        'resolution': f'{frames[0].shape[1]}x{frames[0].shape[0]}',
+        **result
+    })
+
+# verify-batch limits: larger batches are rejected as a whole (400)
+BATCH_MAX_ITEMS = int(os.environ.get('FACE_BATCH_MAX_ITEMS', 32))
+batch_decoder = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='batch-decode')
+
+def decode_batch_item(item, reduce):
+    """(frame or None, error or None, decode ms) for one verify-batch item"""
+    start = time.perf_counter()
+    try:
+        frame = decode_image(image_bytes_from_base64(item['image']), reduce)
+        error = None if frame is not None else 'Could not decode image'
+    except (ValueError, TypeError):
+        frame, error = None, 'Image is not valid base64'
+    return frame, error, (time.perf_counter() - start) * 1000
+
+@app.route('/api/face/verify-batch', methods=['POST'])
+def verify_batch():
+    """Verify many (username, image) pairs in one request
+    
+    Body: {"items": [{"username": ..., "image": <base64>}, ...], "reduce": 1|2|4|8}.
+    A malformed request, or more than BATCH_MAX_ITEMS items, fails as a
+    whole with 400. Otherwise the response is 200 with one result per item
+    in input order; an item that can't be processed (bad image, unknown
+    user, no face...) fails alone with success false and an error or
+    outcome, and never affects the others.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'items must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'error': f'Too many items ({len(items)}); the limit is {BATCH_MAX_ITEMS}',
+            'max_items': BATCH_MAX_ITEMS
+        }), 400
+    try:
+        reduce = request_reduce()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    started = time.perf_counter()
+    errors = [None] * len(items)
+    decoded = [(None, None, 0.0)] * len(items)
+    futures = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('username'), str) or not item['username']:
+            errors[i] = 'username is required'
+        elif not isinstance(item.get('image'), str) or not item['image']:
+            errors[i] = 'image is required (base64 string)'
+        else:
+            # cv2.imdecode releases the GIL, so items decode in parallel
+            futures[i] = batch_decoder.submit(decode_batch_item, item, reduce)
+    for i, future in futures.items():
+        decoded[i] = future.result()
+        errors[i] = decoded[i][1]
+    decode_ms = (time.perf_counter() - started) * 1000
+    
+    pairs = [(item['username'] if error is None else None, frame)
+             for item, error, (frame, _, _) in zip(items, errors, decoded)]
+    results, stages = face_system.verify_frames_batch(pairs, min_size=face_system.min_face_size // reduce)
+    
+    response_items = []
+    for item, result, error, (_, _, item_decode_ms) in zip(items, results, errors, decoded):
+        entry = {
+            'username': item.get('username') if isinstance(item, dict) else None,
+            'success': error is None and result['verified'],
+            'decode_ms': round(item_decode_ms, 3)
+        }
+        if error is not None:
+            entry.update({'verified': False, 'error': error, 'outcome': 'invalid_item'})
+        else:
+            entry.update(result)
+        response_items.append(entry)
+    
+    verified = sum(1 for entry in response_items if entry['verified'])
+    return jsonify({
+        'success': True,
+        'total': len(items),
+        'verified': verified,
+        'failed': len(items) - verified,
+        'items': response_items,
+        'stages': {'decode_ms': round(decode_ms, 3), **stages},
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+    })
+
+@app.route('/api/face/register-image', methods=['POST'])
+def register_image():
+    """Register a user's face from one or more uploaded images"""
+    username = request_username()
+    if not username:
+        return jsonify({'success': False, 'error': 'Username is required'}), 400
+    if username in face_system.known_faces:
+        return jsonify({
+            'success': False,
+            'error': 'User already registered',
+            'registered_at': face_system.known_faces[username]['registered']
+        }), 400
+    
+    try:
+        frames, reduce, decode_ms = decode_request_images()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    result = face_system.register_frames(username, frames, min_size=face_system.min_face_size // reduce)
+    registered = result['registered']
+    return jsonify({
+        'success': registered,
+        'username': username,
+        'message': 'User registered successfully' if registered else 'No usable face in the uploaded images',
+        'decode_ms': round(decode_ms, 3),
+        **result
+    }), 200 if registered else 422
+
+# Streaming verification: the browser pushes its own webcam frames and the
+# server verifies only the newest one (see streaming.py), so no server camera
+# is needed. Sessions are driven over a WebSocket (flask-sock) or plain HTTP.
+STREAM_MAX_DEADLINE_MS = float(os.environ.get('FACE_STREAM_MAX_DEADLINE_MS', 30000))
+stream_sessions = StreamSessions(
+    max_sessions=int(os.environ.get('FACE_STREAM_MAX_SESSIONS', 32)),
+    keep_seconds=float(os.environ.get('FACE_STREAM_KEEP_SECONDS', 30))
+)
+
+def finish_stream_session(session):
+    """Log a finished stream session once, like verify_user_deadline"""
+    status = session.status()
+    face_system.log_verification(session.username, 'stream_verification', status['verified'], {
+        'distance': status['distance'], 'outcome': status['outcome'],
+        'deadline_ms': session.deadline_ms, 'frames_received': status['frames_received'],
+        'frames_dropped': status['frames_dropped'], 'frames_processed': status['frames_processed']
+    })
+    if status['verified']:
+        print(f"✓ Stream verification successful! Distance: {status['distance']:.4f} "
+              f"({status['frames_processed']} frames in {status['elapsed_ms']:.0f} ms)")
+    else:
+        print(f"✗ Stream verification {status['outcome']} after {status['frames_processed']} frames")
+
+def open_stream_session(params):
+    """(session, None, None) for start parameters, or (None, error, HTTP status)"""
+    username = params.get('username')
+    if not isinstance(username, str) or not username:
+        return None, 'Username is required', 400
+    if username not in face_system.known_faces:
+        return None, 'User not registered', 404
+    try:
+        deadline_ms = min(STREAM_MAX_DEADLINE_MS, max(1.0, float(params.get('deadline_ms', 5000))))
+        reduce = int(params.get('reduce', 1))
+    except (TypeError, ValueError):
+        return None, 'deadline_ms and reduce must be numbers', 400
+    if reduce not in REDUCED_DECODE_FLAGS:
+        return None, f"reduce must be one of {sorted(REDUCED_DECODE_FLAGS)}", 400
+    
+    min_size = face_system.min_face_size // reduce
+    session = stream_sessions.open(
+        username,
+        decode=lambda data: decode_image(data, reduce),
+        verify=lambda frame: face_system.verify_frame(username, frame, min_size=min_size, log=False),
+        deadline_ms=deadline_ms,
+        on_finish=finish_stream_session
+    )
+    if session is None:
+        return None, 'Too many streaming sessions; try again shortly', 503
+    return session, None, None
+
+@app.route('/api/face/stream/start', methods=['POST'])
+def stream_start():
+    """Start a streaming verification session fed by /api/face/stream/<id>/frame"""
+    data = request.get_json(silent=True) or {}
+    session, error, code = open_stream_session(data)
+    if session is None:
+        return jsonify({'success': False, 'error': error}), code
+    return jsonify({'success': True, **session.status()})
+
+@app.route('/api/face/stream/<session_id>/frame', methods=['POST'])
+def stream_frame(session_id):
+    """Push one encoded frame; returns the session status at once, never waits for verification"""
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired session'}), 404
+    try:
+        payloads = request_image_bytes()
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'Image is not valid base64'}), 400
+    if not payloads:
+        return jsonify({'success': False, 'error': 'Image is required'}), 400
+    accepted = session.push(payloads[-1])
+    return jsonify({'success': True, 'accepted': accepted, **session.status()})
+
+@app.route('/api/face/stream/<session_id>', methods=['GET'])
+def stream_status(session_id):
+    """Session status; ?wait=<seconds> long-polls until the session finishes"""
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired session'}), 404
+    try:
+        wait = min(30.0, max(0.0, float(request.args.get('wait', 0))))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'wait must be a number'}), 400
+    if wait:
+        session.wait(wait)
+    return jsonify({'success': True, **session.status()})
+
+@app.route('/api/face/stream/<session_id>', methods=['DELETE'])
+def stream_cancel(session_id):
+    """Stop a session early (e.g. the user closed the dialog)"""
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired session'}), 404
+    session.cancel()
+    return jsonify({'success': True, **session.status()})
+
+if SOCK_AVAILABLE:
+    sock = Sock(app)
+    
+    @sock.route('/api/face/stream')
+    def stream_socket(ws):
+        """Streaming verification over one WebSocket
+        
+        The first message is JSON {username, deadline_ms, reduce}; every
+        later message is a frame (binary JPEG, or base64 / data URL text).
+        The server answers with 'started', periodic 'progress' messages and
+        one 'result' as soon as a face matches or the deadline passes.
+        """
+        try:
+            params = json.loads(ws.receive(timeout=10) or '{}')
+        except (ValueError, TypeError):
+            params = {}
+        session, error, code = open_stream_session(params if isinstance(params, dict) else {})
+        if session is None:
+            ws.send(json.dumps({'type': 'error', 'success': False, 'error': error, 'code': code}))
+            return
+        ws.send(json.dumps({'type': 'started', 'success': True, **session.status()}))
+        
+        last_progress = time.monotonic()
+        try:
+            while not session.done.is_set():
+                # Short timeout so the result goes out promptly even between frames
+                message = ws.receive(timeout=0.05)
+                if message is not None:
+                    if isinstance(message, str):
+                        if message.startswith('{'):
+                            # Control message, e.g. {"cancel": true}
+                            if json.loads(message).get('cancel'):
+                                session.cancel()
+                            continue
+                        message = image_bytes_from_base64(message)
+                    session.push(message)
+                if time.monotonic() - last_progress >= 0.5:
+                    last_progress = time.monotonic()
+                    ws.send(json.dumps({'type': 'progress', **session.status()}))
+            ws.send(json.dumps({'type': 'result', 'success': session.outcome == 'match', **session.status()}))
+        except ConnectionClosed:
+            session.cancel()
+        except (ValueError, TypeError, AttributeError) as e:
+            session.cancel()
+            ws.send(json.dumps({'type': 'error', 'success': False, 'error': f'Invalid message: {e}'}))
+
 @app.route('/api/face/quick-verify', methods=['POST'])
 def quick_verify():
     """Quick verification with single attempt"""
@@ -607,6 +1612,7 @@ def check_registered():
         'registered_at': user_data.get('registered'),
         'samples': user_data.get('samples', 0),
         'method': user_data.get('method', 'unknown'),
+        'descriptor': user_data.get('descriptor'),
         'camera_available': face_system.camera_available
     })
 
@@ -619,7 +1625,8 @@ def list_users():
             'username': username,
             'registered_at': data.get('registered'),
             'samples': data.get('samples', 0),
-            'method': data.get('method', 'unknown')
+            'method': data.get('method', 'unknown'),
+            'descriptor': data.get('descriptor')
         })
     
     return jsonify({
@@ -674,6 +1681,23 @@ def update_threshold():
     except (ValueError, TypeError):
         return jsonify({'success': False, 'error': 'Invalid threshold value'}), 400
 
+@app.route('/api/face/detector-strategy', methods=['POST'])
+def update_detector_strategy():
+    """Switch face detector strategy (dnn, haar, sequential, race, auto)"""
+    data = request.json
+    strategy = data.get('strategy')
+    
+    try:
+        old_strategy = face_system.detection.strategy
+        face_system.detection.set_strategy(strategy)
+        return jsonify({
+            'success': True,
+            'message': f'Detector strategy updated from {old_strategy} to {strategy}',
+            'detection': face_system.detection.stats()
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 @app.route('/api/face/delete-user', methods=['POST'])
 def delete_user():
     """Delete a registered user"""
@@ -708,16 +1732,21 @@ def test_camera():
     
     if frame is not None:
         # Convert to base64 for response
-        _, buffer = cv2.imencode('.jpg', frame)
+        _, buffer = cv2.imencode('.jpg', frame.image)
         img_str = base64.b64encode(buffer).decode('utf-8')
         
-        # Detect faces
+        # Detections test_camera() already ran on this frame
         faces = face_system.detect_faces(frame)
         
         return jsonify({
             'success': True,
             'camera_working': True,
             'faces_detected': len(faces),
+            'faces': [{
+                'box': list(face),
+                'landmarks': face.landmarks.tolist() if face.landmarks is not None else None,
+                'score': face.score
+            } for face in faces],
             'image': img_str,
             'message': message,
             'resolution': f'{frame.shape[1]}x{frame.shape[0]}'
@@ -757,6 +1786,9 @@ def health_check():
             'registered_users': len(face_system.known_faces),
             'camera_available': face_system.camera_available,
             'dnn_available': face_system.dnn_model is not None,
+            'encoder': face_system.encoders.active,
+            'cache': face_system.cache.stats(),
+            'capture': face_system.camera.stats(),
             'cascade_available': face_system.cascade_loaded,
             'threshold': face_system.threshold,
             'logs_count': len(face_system.verification_logs)
@@ -774,17 +1806,28 @@ if __name__ == '__main__':
     print(f"Verification threshold: {face_system.threshold}")
     print(f"Camera available: {face_system.camera_available}")
     print(f"Using DNN model: {face_system.dnn_model is not None}")
+    print(f"Using YuNet model: {face_system.yunet is not None}")
+    print(f"Face encoder: {face_system.encoders.active}")
     print(f"Haar Cascade loaded: {face_system.cascade_loaded}")
     print("\nAvailable endpoints:")
     print("  GET  /api/face/status          - System status")
     print("  POST /api/face/register        - Register new user")
     print("  POST /api/face/verify          - Verify user identity")
     print("  POST /api/face/quick-verify    - Quick verification")
+    print("  POST /api/face/verify-image    - Verify from an uploaded image")
+    print("  POST /api/face/register-image  - Register from uploaded images")
+    print("  POST /api/face/verify-batch    - Verify many username/image pairs")
+    print("  POST /api/face/stream/start    - Start verifying client-pushed frames")
+    print("  POST /api/face/stream/<id>/frame - Push a frame (latest wins)")
+    print("  GET  /api/face/stream/<id>     - Stream verification result")
+    if SOCK_AVAILABLE:
+        print("  WS   /api/face/stream          - Stream frames over a WebSocket")
     print("  POST /api/face/check-registered - Check registration")
     print("  GET  /api/face/users           - List users")
     print("  GET  /api/face/stats/<user>    - User statistics")
     print("  GET  /api/face/logs            - Verification logs")
     print("  POST /api/face/update-threshold - Update threshold")
+    print("  POST /api/face/detector-strategy - Switch detector strategy")
     print("  POST /api/face/delete-user     - Delete user")
     print("  GET  /api/face/test-camera     - Test camera")
     print("  GET  /api/face/snapshot        - Get camera snapshot")
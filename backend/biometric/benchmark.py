@@ -0,0 +1,299 @@
+# benchmark.py - Equivalence checks and microbenchmarks for the face pipeline
+#
+# Usage: python benchmark.py [--faces N]
+import argparse
+import time
+import cv2
+import numpy as np
+
+from encoders import EncoderRegistry, compute_distance, compute_pairwise_distance, feature_weights
+from lbp import chi_square_distance, get_lbp_engine, lbp_histogram
+from frame_context import FrameContext
+from quality import QualityGate
+from capture import CameraService
+from frame_sources import SyntheticSource
+from templates import TEMPLATE_STORAGE, pack_template, quantized_distance, quantized_pairwise_distance, \
+    stack_templates, unpack_template
+
+
+def reference_lbp_histogram(image, radius=2, points=16):
+    """Original per-pixel LBP loop, kept as the equivalence baseline"""
+    height, width = image.shape
+    lbp_image = np.zeros((height-2*radius, width-2*radius), dtype=np.uint8)
+
+    for i in range(radius, height-radius):
+        for j in range(radius, width-radius):
+            center = image[i, j]
+            binary_code = 0
+            power = 0
+            for p in range(points):
+                angle = 2 * np.pi * p / points
+                x = int(j + radius * np.cos(angle))
+                y = int(i - radius * np.sin(angle))
+                if x >= 0 and x < width and y >= 0 and y < height:
+                    binary_code |= (image[y, x] >= center) << power
+                power += 1
+            lbp_image[i-radius, j-radius] = binary_code
+
+    hist, _ = np.histogram(lbp_image.ravel(), bins=256, range=(0, 256))
+    hist = hist.astype("float")
+    if hist.sum() > 0:
+        hist /= hist.sum()
+    return hist
+
+
+def synthetic_faces(count, size=128, seed=0):
+    """Random grayscale crops plus a few structured ones (flat, gradient)"""
+    rng = np.random.default_rng(seed)
+    faces = [rng.integers(0, 256, (size, size), dtype=np.uint8) for _ in range(count)]
+    faces.append(np.full((size, size), 128, dtype=np.uint8))
+    ramp = np.linspace(0, 255, size).astype(np.uint8)
+    faces.append(np.tile(ramp, (size, 1)))
+    faces.append(np.tile(ramp[:, None], (1, size)))
+    return faces
+
+
+def faces_per_second(fn, faces):
+    start = time.perf_counter()
+    for face in faces:
+        fn(face)
+    elapsed = time.perf_counter() - start
+    return len(faces) / elapsed if elapsed > 0 else float('inf')
+
+
+def bench_lbp(num_faces):
+    print("LBP histogram (128x128, radius=2, points=16)")
+    faces = synthetic_faces(num_faces)
+
+    mismatches = sum(
+        not np.array_equal(reference_lbp_histogram(face), lbp_histogram(face))
+        for face in faces
+    )
+    if mismatches:
+        print(f"  ✗ {mismatches}/{len(faces)} histograms differ from the reference loop")
+        return False
+    print(f"  ✓ {len(faces)} histograms identical to the reference loop")
+
+    reference_rate = faces_per_second(reference_lbp_histogram, faces[:3])
+    vectorized_rate = faces_per_second(lbp_histogram, faces * 10)
+    print(f"  reference:  {reference_rate:10.1f} faces/sec")
+    print(f"  vectorized: {vectorized_rate:10.1f} faces/sec ({vectorized_rate / reference_rate:.0f}x)")
+
+    for radius, points, mode in ((2, 8, 'uniform'), (2, 16, 'riu2')):
+        engine = get_lbp_engine(radius, points, mode)
+        rate = faces_per_second(engine.histogram, faces * 10)
+        print(f"  {mode:<10}  {rate:10.1f} faces/sec, {engine.bins} bins (P={points}, R={radius})")
+    return True
+
+
+def reference_grid_histogram(engine, image, grid):
+    """Per-cell loop version of LBPEngine.grid_histogram"""
+    codes = engine.lookup[engine.codes(image)]
+    rows, cols = codes.shape
+    cell_y = (np.arange(rows) * grid[0]) // rows
+    cell_x = (np.arange(cols) * grid[1]) // cols
+    cells = []
+    for cy in range(grid[0]):
+        for cx in range(grid[1]):
+            block = codes[cell_y == cy][:, cell_x == cx]
+            hist = np.bincount(block.ravel(), minlength=engine.bins).astype("float")
+            cells.append(hist / hist.sum() if hist.sum() > 0 else hist)
+    return np.concatenate(cells)
+
+
+def bench_lbph(num_faces, gallery_size=10000):
+    print("Spatial LBPH (8x8 cells, radius=1, points=8, uniform)")
+    engine = get_lbp_engine(1, 8, 'uniform')
+    grid = (8, 8)
+    faces = synthetic_faces(num_faces)
+
+    mismatches = sum(
+        not np.allclose(reference_grid_histogram(engine, face, grid), engine.grid_histogram(face, grid))
+        for face in faces
+    )
+    if mismatches:
+        print(f"  ✗ {mismatches}/{len(faces)} grid histograms differ from the per-cell loop")
+        return False
+    print(f"  ✓ {len(faces)} grid histograms match the per-cell loop")
+
+    loop_rate = faces_per_second(lambda f: reference_grid_histogram(engine, f, grid), faces)
+    rate = faces_per_second(lambda f: engine.grid_histogram(f, grid), faces * 10)
+    print(f"  per-cell loop: {loop_rate:10.1f} faces/sec")
+    print(f"  single pass:   {rate:10.1f} faces/sec")
+
+    probe = engine.grid_histogram(faces[0], grid)
+    gallery = np.tile(probe, (gallery_size, 1))
+    start = time.perf_counter()
+    chi_square_distance(probe, gallery, cells=64)
+    elapsed = time.perf_counter() - start
+    print(f"  chi-square:    {gallery_size / elapsed:10.1f} templates/sec ({gallery_size} x {probe.size})")
+    return True
+
+
+def template_bytes(fields):
+    return sum(np.asarray(v).nbytes for k, v in fields.items() if k != 'storage')
+
+
+def bench_templates(gallery_size=2000, threshold=0.6, seed=1):
+    print(f"Template storage ({gallery_size} templates, decision threshold {threshold})")
+    rng = np.random.default_rng(seed)
+    cases = [
+        # (label, metric, gallery)
+        ('128-d embedding', 'euclidean', rng.normal(0, 0.09, (gallery_size, 128))),
+        ('175-d uniform histograms', 'weighted_euclidean', rng.dirichlet(np.ones(175) * 0.3, gallery_size)),
+    ]
+
+    for label, metric, gallery in cases:
+        dim = gallery.shape[1]
+        weights = feature_weights(dim) if metric == 'weighted_euclidean' else None
+        # Genuine probes are noisy copies; impostors are other templates
+        probes = np.vstack([
+            gallery[:50] + rng.normal(0, gallery.std() * 0.3, (50, dim)),
+            gallery[rng.permutation(gallery_size)[:50]],
+        ])
+        exact = np.array([compute_distance(metric, p, gallery) for p in probes])
+        print(f"  {label}:")
+
+        for storage in TEMPLATE_STORAGE:
+            packed = [pack_template(g, storage, weights) for g in gallery]
+            size = template_bytes(packed[0])
+
+            start = time.perf_counter()
+            if storage == 'int8':
+                q, scale, offset, sq_norm = stack_templates(packed)
+                approx = np.array([quantized_distance(metric, p, q, scale, offset, sq_norm, weights)
+                                   for p in probes])
+            else:
+                stacked = np.stack([t['encoding'] for t in packed])
+                approx = np.array([compute_distance(metric, p, stacked) for p in probes])
+            elapsed = time.perf_counter() - start
+
+            error = np.abs(approx - exact)
+            agree = np.mean((approx < threshold) == (exact < threshold)) * 100
+            rate = probes.shape[0] * gallery_size / elapsed
+            print(f"    {storage:<8} {size:6d} B/template  max err {error.max():.2e}  "
+                  f"mean err {error.mean():.2e}  decisions {agree:6.2f}% same  {rate:12.0f} cmp/sec")
+    return True
+
+
+def bench_pairwise(pairs=256, seed=2):
+    print(f"Batch comparison ({pairs} probe/template pairs)")
+    rng = np.random.default_rng(seed)
+    ok = True
+    for metric, dim, cells in (('euclidean', 128, 1), ('cosine', 128, 1),
+                               ('weighted_euclidean', 175, 1), ('chi_square', 3776, 64)):
+        probes = rng.dirichlet(np.ones(dim), pairs)
+        gallery = rng.dirichlet(np.ones(dim), pairs)
+        start = time.perf_counter()
+        batched = compute_pairwise_distance(metric, probes, gallery, cells)
+        elapsed = time.perf_counter() - start
+        single = np.array([compute_distance(metric, p, g, cells) for p, g in zip(probes, gallery)])
+        same = np.allclose(batched, single, rtol=1e-9, atol=1e-12)
+        ok = ok and same
+        print(f"  {metric:<20} {pairs / elapsed:12.0f} pairs/sec  matches per-pair: {'OK' if same else 'FAIL'}")
+    return ok
+
+
+def bench_batch_encode(num_frames=8, descriptor='uniform', seed=3):
+    print(f"Batch encode + compare ({num_frames} frames, feature_based/{descriptor})")
+    registry = EncoderRegistry(preferred='feature_based', descriptor=descriptor)
+    encoder = registry.get('feature_based')
+    rng = np.random.default_rng(seed)
+    box = (40, 30, 128, 128)
+    frames = []
+    for face in synthetic_faces(num_frames, seed=seed)[:num_frames]:
+        image = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+        image[30:158, 40:168] = face[..., None]
+        frames.append(FrameContext(image))
+
+    # The same path verify_frames_batch takes: one encode_faces call across frames
+    start = time.perf_counter()
+    batched = registry.encode_faces([(frame, box) for frame in frames], 'feature_based', descriptor=descriptor)
+    elapsed = time.perf_counter() - start
+    single = [registry.encode_frame(frame, [box], 'feature_based', descriptor=descriptor)[0] for frame in frames]
+    same = all(b[1] == s[1] == 'feature_based' and np.allclose(b[0], s[0]) for b, s in zip(batched, single))
+
+    # Batched distances to stored templates match the per-face comparison
+    metric, weights, cells = encoder.metric_params(descriptor)
+    templates = [pack_template(s[0], 'float32', weights) for s in reversed(single)]
+    probes = np.stack([encoding for encoding, _ in batched])
+    distances = compute_pairwise_distance(metric, probes, np.stack([unpack_template(t) for t in templates]), cells)
+    expected = [encoder.distance(p, unpack_template(t), descriptor) for p, t in zip(probes, templates)]
+    close = np.allclose(distances, expected, rtol=1e-5, atol=1e-7)
+
+    # int8 templates: row-wise quantized comparison matches the per-template one
+    packed = [pack_template(s[0], 'int8', weights) for s in reversed(single)]
+    q, scale, offset, sq_norm = stack_templates(packed)
+    quantized = quantized_pairwise_distance(metric, probes, q, scale, offset, sq_norm, weights, cells)
+    per_pair = [quantized_distance(metric, p, t['encoding'], t['scale'], t['offset'], t['sq_norm'], weights, cells)
+                for p, t in zip(probes, packed)]
+    close_int8 = np.allclose(quantized, per_pair, rtol=1e-9, atol=1e-12)
+    print(f"  {num_frames / elapsed:.0f} faces/sec  matches per-frame encode: {'OK' if same else 'FAIL'}  "
+          f"distances: {'OK' if close else 'FAIL'}  int8: {'OK' if close_int8 else 'FAIL'}")
+    return same and close and close_int8
+
+
+def bench_quality(num_faces, frame_size=(720, 1280)):
+    print(f"Quality gate ({num_faces} faces on {frame_size[1]}x{frame_size[0]} frames)")
+    gate = QualityGate(min_size=100)
+    faces = synthetic_faces(num_faces, size=256)
+    box = (100, 100, 256, 256)
+
+    ok = True
+    elapsed = 0.0
+    for face in faces:
+        image = np.zeros(frame_size + (3,), dtype=np.uint8)
+        image[100:356, 100:356] = face[..., None]
+        frame = FrameContext(image)
+        start = time.perf_counter()
+        sharp = gate.measure(frame, box)
+        elapsed += time.perf_counter() - start
+
+        image[100:356, 100:356] = cv2.GaussianBlur(image[100:356, 100:356], (15, 15), 5)
+        blurred = gate.measure(FrameContext(image), box)
+        ok = ok and blurred['sharpness'] <= sharp['sharpness']
+
+    print(f"  {elapsed / len(faces) * 1000:.3f} ms/face  blur lowers sharpness: {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def bench_capture(num_frames=200, fps=30.0):
+    print(f"Camera service ({num_frames} synthetic frames at {fps:.0f} fps)")
+    service = CameraService(SyntheticSource(fps=fps))
+    service.start()
+    ok = True
+    try:
+        with service.subscribe('bench') as feed:
+            last = None
+            for _ in range(num_frames):
+                frame, timestamp = feed.next(timeout=1.0)
+                ok = ok and frame is not None and (last is None or timestamp > last)
+                last = timestamp
+    finally:
+        service.stop()
+
+    stats = service.stats()['subscribers']['bench']
+    buffers = service.pool.stats()
+    print(f"  delivered {stats['fps']:.1f} fps  latency {stats['mean_latency_ms']:.3f} ms  "
+          f"wait {stats['mean_wait_ms']:.2f} ms  skipped {stats['skipped']}  "
+          f"fresh frames: {'OK' if ok else 'FAIL'}")
+    # Ring buffer + the frame being read + the one the reader holds; everything else is reused
+    recycled = buffers['allocations'] <= service.buffer_size + 3
+    print(f"  {buffers['allocations']} buffer allocations, {buffers['reuses']} reuses: "
+          f"{'OK' if recycled else 'FAIL'}")
+    return ok and recycled
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Face pipeline benchmarks')
+    parser.add_argument('--faces', type=int, default=20, help='random crops per check')
+    args = parser.parse_args()
+
+    ok = bench_lbp(args.faces)
+    ok = bench_lbph(args.faces) and ok
+    ok = bench_templates() and ok
+    ok = bench_pairwise() and ok
+    ok = bench_batch_encode() and ok
+    ok = bench_quality(args.faces) and ok
+    ok = bench_capture() and ok
+    raise SystemExit(0 if ok else 1)
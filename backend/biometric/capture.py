@@ -0,0 +1,349 @@
+# capture.py - Single-owner camera service that multiplexes frames to subscribers
+import threading
+import time
+import weakref
+from collections import deque
+import numpy as np
+
+# Allocation rate is reported over this many trailing seconds
+ALLOCATION_WINDOW = 10.0
+# How often a waiting reader checks its stop event
+STOP_POLL_INTERVAL = 0.05
+
+
+class FramePool:
+    """Preallocated frame buffers, recycled once nothing references them
+
+    The capture thread reads into acquire()d buffers. Readers get view()s:
+    read-only arrays backed by a fresh memoryview of the buffer, so every
+    slice a reader takes (crops, ROIs) keeps that memoryview alive too. Each
+    view holds one reference on its buffer and gives it back when the view
+    and everything sliced from it has been garbage collected; the capture
+    thread holds one more while the frame sits in the ring buffer. A buffer
+    whose count drops to zero goes back on the free list instead of being
+    freed, so at a steady state read() never allocates.
+    """
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.free = []
+        self.refs = {}  # id(buffer) -> (buffer, references)
+        # Reentrant: a garbage collection inside a locked section may finalize a view
+        self.lock = threading.RLock()
+        self.allocations = 0
+        self.reuses = 0
+        self.allocated_at = deque()
+
+    def _count_allocation(self):
+        now = time.monotonic()
+        self.allocations += 1
+        self.allocated_at.append(now)
+        while self.allocated_at and now - self.allocated_at[0] > ALLOCATION_WINDOW:
+            self.allocated_at.popleft()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Free buffer of this shape (allocated if none), holding one reference"""
+        with self.lock:
+            for i, buffer in enumerate(self.free):
+                if buffer.shape == tuple(shape) and buffer.dtype == dtype:
+                    del self.free[i]
+                    self.reuses += 1
+                    break
+            else:
+                buffer = np.empty(shape, dtype=dtype)
+                self._count_allocation()
+            self.refs[id(buffer)] = (buffer, 1)
+            return buffer
+
+    def adopt(self, frame):
+        """Take over an array the source allocated itself (e.g. after a resolution change)"""
+        with self.lock:
+            self._count_allocation()
+            self.refs[id(frame)] = (frame, 1)
+            return frame
+
+    def view(self, buffer):
+        """Read-only view of a held buffer that references it until garbage collected"""
+        key = id(buffer)
+        with self.lock:
+            buffer, count = self.refs[key]
+            self.refs[key] = (buffer, count + 1)
+        memory = memoryview(buffer).toreadonly()
+        weakref.finalize(memory, self.release, key)
+        return np.asarray(memory)
+
+    def release(self, buffer_or_key):
+        key = buffer_or_key if isinstance(buffer_or_key, int) else id(buffer_or_key)
+        with self.lock:
+            entry = self.refs.get(key)
+            if entry is None:
+                return
+            buffer, count = entry
+            if count > 1:
+                self.refs[key] = (buffer, count - 1)
+                return
+            del self.refs[key]
+            if len(self.free) < self.max_free:
+                self.free.append(buffer)
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            recent = sum(1 for t in self.allocated_at if now - t <= ALLOCATION_WINDOW)
+            return {
+                'allocations': self.allocations,
+                'reuses': self.reuses,
+                'allocations_per_sec': recent / ALLOCATION_WINDOW,
+                'in_use': len(self.refs),
+                'free': len(self.free),
+                'bytes': sum(b.nbytes for b, _ in self.refs.values()) + sum(b.nbytes for b in self.free)
+            }
+
+
+class SubscriberStats:
+    """Delivery counters for one named consumer (e.g. 'verify', 'snapshot')"""
+
+    def __init__(self, name):
+        self.name = name
+        self.active = 0
+        self.frames = 0
+        self.skipped = 0
+        self.timeouts = 0
+        self.total_latency_ms = 0.0
+        self.total_wait_ms = 0.0
+        self.first_at = None
+        self.last_at = None
+
+    def record(self, latency_ms, wait_ms, skipped):
+        now = time.monotonic()
+        self.frames += 1
+        self.skipped += skipped
+        self.total_latency_ms += latency_ms
+        self.total_wait_ms += wait_ms
+        self.first_at = self.first_at or now
+        self.last_at = now
+
+    def to_dict(self):
+        span = (self.last_at - self.first_at) if self.frames > 1 else 0.0
+        return {
+            'active': self.active,
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'timeouts': self.timeouts,
+            'fps': (self.frames - 1) / span if span > 0 else 0.0,
+            'mean_latency_ms': self.total_latency_ms / self.frames if self.frames else 0.0,
+            'mean_wait_ms': self.total_wait_ms / self.frames if self.frames else 0.0
+        }
+
+
+class Subscription:
+    """One consumer's cursor into the camera feed
+
+    next() only returns frames this subscription has not seen yet, so a
+    loop never processes the same frame twice; frames that arrived while
+    it was busy are skipped (and counted), never queued.
+    """
+
+    def __init__(self, service, stats):
+        self.service = service
+        self.stats = stats
+        self.last_seq = None
+        self.last_timestamp = None
+
+    def next(self, timeout=1.0, stop=None, after=None):
+        """(frame, timestamp) newer than the last one returned, or (None, None) on timeout or stop
+
+        `after` additionally skips frames up to that timestamp (e.g. to space samples apart).
+        """
+        newer_than = self.last_timestamp
+        if after is not None:
+            newer_than = after if newer_than is None else max(newer_than, after)
+        return self._take(newer_than, timeout, stop)
+
+    def _take(self, newer_than, timeout, stop=None):
+        start = time.monotonic()
+        entry = self.service._wait(newer_than, timeout, stop)
+        with self.service.cond:
+            if entry is None:
+                self.stats.timeouts += 1
+                return None, None
+            timestamp, seq, frame = entry
+            now = time.monotonic()
+            skipped = max(0, seq - self.last_seq - 1) if self.last_seq is not None else 0
+            self.stats.record((now - timestamp) * 1000, (now - start) * 1000, skipped)
+        self.last_seq, self.last_timestamp = seq, timestamp
+        return frame, timestamp
+
+    def close(self):
+        with self.service.cond:
+            self.stats.active -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CameraService:
+    """Owns a capture device exclusively and shares its frames with any number of readers
+
+    A daemon thread is the only code that calls cap.read(). It keeps a
+    small ring buffer of (timestamp, seq, buffer) entries, newest last, and
+    wakes every waiting subscriber on each new frame. Readers get read-only
+    views of the pooled buffers (see FramePool), so delivery is O(1) under
+    the lock, nothing is copied, and no subscriber can hold up or drain
+    frames from another: every subscriber is offered every newest frame.
+    Reading continuously also drains the driver's own queue, so nobody
+    gets a stale buffered frame. Timestamps are time.monotonic() at the
+    moment read() returned.
+    """
+
+    def __init__(self, cap, buffer_size=4, retry_delay=0.05):
+        self.cap = cap
+        self.retry_delay = retry_delay
+        self.frames = deque()
+        self.buffer_size = buffer_size
+        # Ring buffer + a few frames held by readers at once
+        self.pool = FramePool(max_free=buffer_size + 4)
+        self.frame_shape = None
+        self.cond = threading.Condition()
+        self.subscribers = {}
+        self.running = False
+        self.thread = None
+        # Metrics
+        self.frames_read = 0
+        self.read_errors = 0
+        self.started_at = None
+        # Smoothed interval between delivered frames, for the measured frame rate
+        self.frame_interval = None
+        self.last_frame_at = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name='camera-service', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        with self.cond:
+            self.cond.notify_all()
+
+    def _read(self):
+        """(ret, buffer) with one pool reference held on buffer when ret is true"""
+        if self.frame_shape is None:
+            # First frame: learn the shape, then every later read reuses pool buffers
+            ret, frame = self.cap.read()
+            if ret and frame is not None:
+                self.frame_shape, self.frame_dtype = frame.shape, frame.dtype
+                return True, self.pool.adopt(frame)
+            return False, None
+
+        buffer = self.pool.acquire(self.frame_shape, self.frame_dtype)
+        try:
+            ret, frame = self.cap.read(image=buffer)
+        except Exception:
+            ret, frame = False, None
+        if not ret or frame is None:
+            self.pool.release(buffer)
+            return False, None
+        if frame.ctypes.data != buffer.ctypes.data:
+            # The source allocated instead (resolution change): adopt its array
+            self.pool.release(buffer)
+            self.frame_shape, self.frame_dtype = frame.shape, frame.dtype
+            return True, self.pool.adopt(frame)
+        return True, buffer
+
+    def _run(self):
+        while self.running:
+            try:
+                ret, frame = self._read()
+            except Exception:
+                ret, frame = False, None
+            if not ret or frame is None:
+                self.read_errors += 1
+                # Back off instead of spinning while the device is not delivering
+                time.sleep(self.retry_delay)
+                continue
+
+            timestamp = time.monotonic()
+            if self.last_frame_at is not None:
+                interval = timestamp - self.last_frame_at
+                self.frame_interval = interval if self.frame_interval is None else \
+                    0.9 * self.frame_interval + 0.1 * interval
+            self.last_frame_at = timestamp
+            with self.cond:
+                self.frames_read += 1
+                self.frames.append((timestamp, self.frames_read, frame))
+                if len(self.frames) > self.buffer_size:
+                    # Readers still holding views keep the buffer out of the pool
+                    self.pool.release(self.frames.popleft()[2])
+                self.cond.notify_all()
+
+    def _wait(self, newer_than, timeout, stop=None):
+        def ready():
+            return self.frames and (newer_than is None or self.frames[-1][0] > newer_than)
+
+        with self.cond:
+            if stop is None:
+                if not self.cond.wait_for(ready, timeout):
+                    return None
+            else:
+                # Nothing notifies the condition when stop is set, so wake up periodically to check it
+                end = time.monotonic() + timeout
+                while not ready():
+                    remaining = end - time.monotonic()
+                    if remaining <= 0 or stop.is_set():
+                        return None
+                    self.cond.wait(min(remaining, STOP_POLL_INTERVAL))
+            # Take the view under the lock, before the capture thread can recycle the buffer
+            timestamp, seq, buffer = self.frames[-1]
+            return timestamp, seq, self.pool.view(buffer)
+
+    def subscribe(self, name):
+        """New Subscription; stats are kept per name across subscriptions"""
+        with self.cond:
+            stats = self.subscribers.get(name)
+            if stats is None:
+                stats = self.subscribers[name] = SubscriberStats(name)
+            stats.active += 1
+        return Subscription(self, stats)
+
+    def read(self, newer_than=None, timeout=1.0, stop=None):
+        """One-off (frame, timestamp) newer than `newer_than` (any frame if None), or (None, None)
+
+        Blocks on the condition variable the capture thread notifies, so the
+        caller wakes as soon as the frame arrives and never polls; setting
+        the `stop` event gives up early. Loops should hold a subscribe()d
+        cursor instead, which also keeps per-consumer stats.
+        """
+        entry = self._wait(newer_than, timeout, stop)
+        if entry is None:
+            return None, None
+        timestamp, _, frame = entry
+        return frame, timestamp
+
+    def stats(self):
+        info = self.cap.info() if hasattr(self.cap, 'info') else {}
+        with self.cond:
+            newest = self.frames[-1][0] if self.frames else None
+            subscribers = {name: stats.to_dict() for name, stats in self.subscribers.items()}
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            'running': self.running,
+            'source': info,
+            'buffer_size': self.buffer_size,
+            'buffers': self.pool.stats(),
+            'frames_read': self.frames_read,
+            'read_errors': self.read_errors,
+            'mean_fps': self.frames_read / uptime if uptime > 0 else 0.0,
+            'measured_fps': 1.0 / self.frame_interval if self.frame_interval else 0.0,
+            'latest_frame_age_ms': (time.monotonic() - newest) * 1000 if newest is not None else None,
+            'subscribers': subscribers
+        }
@@ -0,0 +1,424 @@
+# detectors.py - Face detectors, SSD post-processing and detector strategies
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+import numpy as np
+
+from frame_context import FrameContext
+
+SSD_CONFIDENCE = 0.5
+NMS_THRESHOLD = 0.4
+
+
+class FaceBox(tuple):
+    """(x, y, w, h) face box that can also carry detector landmarks and score
+
+    Unpacks, indexes and compares like the plain tuples detect_faces has
+    always returned. `landmarks` is a (5, 2) float array in the same pixel
+    space as the box (right eye, left eye, nose tip, right and left mouth
+    corners, subject's point of view) or None when the detector has none.
+    """
+
+    def __new__(cls, box, landmarks=None, score=None):
+        face = super().__new__(cls, (int(v) for v in box))
+        face.landmarks = landmarks
+        face.score = score
+        return face
+
+    def shifted(self, dx, dy):
+        """Same face in a frame where this box's image sits at (dx, dy)"""
+        x, y, w, h = self
+        landmarks = None if self.landmarks is None else self.landmarks + (dx, dy)
+        return FaceBox((x + dx, y + dy, w, h), landmarks, self.score)
+
+    def rescaled(self, scale, width, height):
+        """Map a box found on an image scaled by `scale` back to a width x height frame"""
+        x, y, w, h = self
+        x0, y0 = int(round(x / scale)), int(round(y / scale))
+        x1, y1 = min(width, int(round((x + w) / scale))), min(height, int(round((y + h) / scale)))
+        landmarks = None if self.landmarks is None else self.landmarks / scale
+        return FaceBox((x0, y0, x1 - x0, y1 - y0), landmarks, self.score)
+
+
+def select_faces(faces, min_size=0, top_k=0):
+    """FaceBoxes with both sides > min_size, largest area first, at most top_k"""
+    faces = [face for face in faces if face[2] > min_size and face[3] > min_size]
+    faces.sort(key=lambda face: face[2] * face[3], reverse=True)
+    return faces[:top_k] if top_k else faces
+
+
+def largest_first(boxes, scores=None, min_size=0, top_k=0):
+    """Keep (x, y, w, h) boxes with both sides > min_size, largest area first, at most top_k"""
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    keep = (boxes[:, 2] > min_size) & (boxes[:, 3] > min_size)
+    boxes = boxes[keep]
+    scores = None if scores is None else np.asarray(scores)[keep]
+
+    order = np.argsort(-(boxes[:, 2] * boxes[:, 3]), kind='stable')
+    if top_k:
+        order = order[:top_k]
+    return boxes[order], (None if scores is None else scores[order])
+
+
+def decode_ssd(detections, width, height, conf_threshold=SSD_CONFIDENCE,
+               nms_threshold=NMS_THRESHOLD, min_size=0, top_k=0):
+    """Turn raw SSD output (1, 1, N, 7) into (x, y, w, h) boxes and scores in one pass
+
+    Confidence mask, scaling to pixels, clipping to the image, NMS,
+    minimum-size filtering and top-k by area are all array operations,
+    instead of a Python loop over every one of the N (usually 200) rows.
+    """
+    rows = detections.reshape(-1, 7)
+    rows = rows[rows[:, 2] > conf_threshold]
+    if len(rows) == 0:
+        return np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    limits = np.array([width, height, width, height], dtype=np.float32)
+    corners = np.clip(rows[:, 3:7] * limits, 0, limits).astype(np.int64)
+    boxes = np.column_stack([corners[:, :2], corners[:, 2:] - corners[:, :2]])
+    scores = rows[:, 2].astype(np.float32)
+
+    # Drop empty/too-small boxes before NMS so they can't suppress real ones
+    valid = (boxes[:, 2] > max(min_size, 0)) & (boxes[:, 3] > max(min_size, 0))
+    boxes, scores = boxes[valid], scores[valid]
+    if len(boxes) == 0:
+        return boxes, scores
+
+    keep = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), conf_threshold, nms_threshold)
+    keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+    return largest_first(boxes[keep], scores[keep], top_k=top_k)
+
+
+class Detector(ABC):
+    """One face detector plus its latency/hit-rate counters
+
+    detect() takes an image or FrameContext and returns (x, y, w, h) boxes
+    in that image's pixels; derived inputs (gray, blob) come from the
+    context. Calls are serialized per detector because neither
+    cv2.dnn.Net nor CascadeClassifier may be run from several threads at
+    once.
+    """
+    name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+
+    @abstractmethod
+    def _detect(self, frame, min_size):
+        """FaceBoxes found in a FrameContext, called with the detector lock held"""
+
+    def detect(self, image, min_size=0):
+        frame = FrameContext.of(image)
+        with self.lock:
+            start = time.perf_counter()
+            faces = self._detect(frame, min_size)
+            self._record([faces], (time.perf_counter() - start) * 1000)
+        return faces
+
+    def detect_batch(self, images, min_size=0):
+        """detect() for several images; backends that can run them in one pass override this"""
+        return [self.detect(image, min_size) for image in images]
+
+    def _record(self, results, elapsed_ms):
+        """Count one call per image; a batched call's time is split evenly between them"""
+        self.calls += len(results)
+        self.hits += sum(1 for faces in results if len(faces))
+        self.total_ms += elapsed_ms
+        self.last_ms = elapsed_ms / max(1, len(results))
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.calls if self.calls else 0.0,
+            'mean_ms': round(self.mean_ms, 3),
+            'last_ms': round(self.last_ms, 3)
+        }
+
+
+class SSDDetector(Detector):
+    """res10 300x300 Caffe SSD"""
+    name = 'dnn'
+
+    def __init__(self, net, top_k=0):
+        super().__init__()
+        self.net = net
+        self.top_k = top_k
+        self.batching = True
+
+    def _detect(self, frame, min_size):
+        h, w = frame.shape[:2]
+        self.net.setInput(frame.blob((300, 300), (104.0, 177.0, 123.0)))
+        detections = self.net.forward()
+
+        # Confidence mask, clipping, NMS, size filter and top-k as array operations
+        return self._faces(detections, w, h, min_size)
+
+    def _faces(self, detections, w, h, min_size):
+        boxes, scores = decode_ssd(detections, w, h, min_size=min_size, top_k=self.top_k)
+        return [FaceBox(box, score=float(score)) for box, score in zip(boxes.tolist(), scores)]
+
+    def detect_batch(self, images, min_size=0):
+        """All images through one forward pass; rows of the output carry their image index"""
+        frames = [FrameContext.of(image) for image in images]
+        if len(frames) < 2 or not self.batching:
+            return [self.detect(frame, min_size) for frame in frames]
+
+        blob = cv2.dnn.blobFromImages([frame.image for frame in frames], 1.0,
+                                      (300, 300), (104.0, 177.0, 123.0))
+        with self.lock:
+            start = time.perf_counter()
+            try:
+                self.net.setInput(blob)
+                rows = self.net.forward().reshape(-1, 7)
+            except cv2.error:
+                print("⚠ SSD model rejected a batched input; detecting one image at a time")
+                self.batching = False
+                rows = None
+            if rows is not None:
+                results = []
+                for i, frame in enumerate(frames):
+                    h, w = frame.shape[:2]
+                    results.append(self._faces(rows[rows[:, 0] == i], w, h, min_size))
+                self._record(results, (time.perf_counter() - start) * 1000)
+                return results
+        return [self.detect(frame, min_size) for frame in frames]
+
+
+class HaarDetector(Detector):
+    """OpenCV frontal-face Haar cascade; never reports faces under min_side full-resolution pixels"""
+    name = 'haar'
+
+    def __init__(self, cascade, min_side=30):
+        super().__init__()
+        self.cascade = cascade
+        self.min_side = min_side
+
+    def _detect(self, frame, min_size):
+        try:
+            # Proxies are downscaled: the floor shrinks with them, like min_size
+            side = max(1, int(min_size), int(self.min_side * frame.scale))
+            faces = self.cascade.detectMultiScale(
+                frame.gray,
+                scaleFactor=1.1,
+                minNeighbors=5,
+                minSize=(side, side)
+            )
+            return [FaceBox(face) for face in faces]
+        except:
+            return []
+
+
+class YuNetDetector(Detector):
+    """OpenCV FaceDetectorYN (YuNet): fast on CPU at small sizes, returns five landmarks
+
+    One detector object is created at startup and reused; its input size is
+    only reset when the frame size changes (the proxy width keeps it stable).
+    """
+    name = 'yunet'
+    default_model = 'face_detection_yunet_2023mar.onnx'
+    model_url = ('https://github.com/opencv/opencv_zoo/raw/main/models/'
+                 'face_detection_yunet/face_detection_yunet_2023mar.onnx')
+
+    def __init__(self, model_path=None, score_threshold=0.6, nms_threshold=0.3, top_k=50):
+        super().__init__()
+        model_path = model_path or self.default_model
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found ({self.model_url})")
+        if not hasattr(cv2, 'FaceDetectorYN'):
+            raise RuntimeError("cv2.FaceDetectorYN requires OpenCV >= 4.5.4")
+
+        self.input_size = (320, 320)
+        self.detector = cv2.FaceDetectorYN.create(
+            model_path, "", self.input_size, score_threshold, nms_threshold, top_k
+        )
+        self.model_path = model_path
+
+    def _detect(self, frame, min_size):
+        h, w = frame.shape[:2]
+        if (w, h) != self.input_size:
+            self.detector.setInputSize((w, h))
+            self.input_size = (w, h)
+
+        _, rows = self.detector.detect(frame.image)
+        if rows is None or len(rows) == 0:
+            return []
+
+        # Rows: x, y, w, h, 5 landmark (x, y) pairs, score
+        corners = np.column_stack([rows[:, :2], rows[:, :2] + rows[:, 2:4]])
+        corners = np.clip(corners, 0, [w, h, w, h]).astype(np.int64)
+        boxes = np.column_stack([corners[:, :2], corners[:, 2:] - corners[:, :2]])
+        keep = (boxes[:, 2] > min_size) & (boxes[:, 3] > min_size)
+        return [
+            FaceBox(box, landmarks=row[4:14].reshape(5, 2).astype(np.float32), score=float(row[14]))
+            for box, row in zip(boxes[keep].tolist(), rows[keep])
+        ]
+
+
+# yunet/dnn/haar: that detector only
+# sequential: first available of YuNet, DNN, Haar that finds something (DNN -> Haar originally)
+# race: all on a thread pool, first non-empty result wins
+# auto: profile all on warm-up frames, then keep the cheapest one that meets the recall target
+SINGLE_DETECTORS = ('yunet', 'dnn', 'haar')
+DETECTOR_STRATEGIES = SINGLE_DETECTORS + ('sequential', 'race', 'auto')
+SEQUENTIAL_ORDER = SINGLE_DETECTORS
+
+
+class DetectionStrategy:
+    """Chooses which detector(s) run on each frame"""
+
+    def __init__(self, detectors, strategy='sequential', recall_target=0.9, warmup_frames=20):
+        self.detectors = detectors  # name -> Detector, only the ones that loaded
+        self.recall_target = recall_target
+        self.warmup_frames = warmup_frames
+        self._executor = None
+        self._lock = threading.Lock()
+        self.set_strategy(strategy)
+
+    def set_strategy(self, strategy):
+        if strategy not in DETECTOR_STRATEGIES:
+            raise ValueError(f"Unknown detector strategy '{strategy}', expected one of {DETECTOR_STRATEGIES}")
+        if strategy in SINGLE_DETECTORS and strategy not in self.detectors:
+            raise ValueError(f"Detector '{strategy}' is not available")
+        with self._lock:
+            self.strategy = strategy
+            # Auto-mode profile: frames seen, frames where any detector found a face,
+            # and per detector how many of those it found
+            self.profiled = 0
+            self.positives = 0
+            self.found = {name: 0 for name in self.detectors}
+            self.chosen = None
+
+    def ordered(self):
+        return [self.detectors[name] for name in SEQUENTIAL_ORDER if name in self.detectors]
+
+    def detect_batch(self, images, min_size=0):
+        """Faces of several images, running each detector once over all images still empty
+
+        Follows the sequential order (or the single/auto-chosen detector), so
+        a batching backend like the SSD sees every image in one pass; race
+        mode has no meaning for a batch and also runs sequentially.
+        """
+        images = [FrameContext.of(image) for image in images]
+        strategy = self.strategy
+        if strategy in SINGLE_DETECTORS:
+            detectors = [self.detectors[strategy]]
+        elif strategy == 'auto' and self.chosen is not None:
+            detectors = self.chosen
+        else:
+            detectors = self.ordered()
+
+        results = [[] for _ in images]
+        remaining = list(range(len(images)))
+        for detector in detectors:
+            if not remaining:
+                break
+            found = detector.detect_batch([images[i] for i in remaining], min_size)
+            for i, faces in zip(remaining, found):
+                results[i] = faces
+            remaining = [i for i in remaining if not len(results[i])]
+        return results
+
+    def detect(self, image, min_size=0):
+        # One context for every detector that runs, so gray/blob are shared
+        image = FrameContext.of(image)
+        strategy = self.strategy
+        if strategy in SINGLE_DETECTORS:
+            return self.detectors[strategy].detect(image, min_size)
+        if strategy == 'race' and len(self.detectors) > 1:
+            return self._race(image, min_size)
+        if strategy == 'auto':
+            return self._auto(image, min_size)
+        return self._sequential(self.ordered(), image, min_size)
+
+    @staticmethod
+    def _sequential(detectors, image, min_size):
+        for detector in detectors:
+            faces = detector.detect(image, min_size)
+            if len(faces):
+                return faces
+        return []
+
+    def _race(self, image, min_size):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self.detectors),
+                                                    thread_name_prefix='detector')
+        pending = {self._executor.submit(d.detect, image, min_size) for d in self.ordered()}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    faces = future.result()
+                except Exception as e:
+                    print(f"Detector failed: {e}")
+                    faces = []
+                if len(faces):
+                    # The slower detector finishes in the background; its result is dropped
+                    return faces
+        return []
+
+    def _auto(self, image, min_size):
+        chosen = self.chosen
+        if chosen is not None:
+            return self._sequential(chosen, image, min_size)
+
+        # Warm-up: run every detector, keep the sequential answer
+        results = {d.name: d.detect(image, min_size) for d in self.ordered()}
+        with self._lock:
+            self.profiled += 1
+            if any(len(faces) for faces in results.values()):
+                self.positives += 1
+                for name, faces in results.items():
+                    self.found[name] += 1 if len(faces) else 0
+            done = self.profiled >= self.warmup_frames and \
+                (self.positives > 0 or self.profiled >= 4 * self.warmup_frames)
+            if done and self.chosen is None:
+                self.chosen = self._pick()
+
+        for d in self.ordered():
+            if len(results[d.name]):
+                return results[d.name]
+        return []
+
+    def _pick(self):
+        """Cheapest detector meeting the recall target, else sequential over all of them"""
+        candidates = [
+            d for d in self.ordered()
+            if self.positives == 0 or self.found[d.name] / self.positives >= self.recall_target
+        ]
+        if not candidates:
+            print("⚠ No single detector meets the recall target; auto mode stays sequential")
+            return self.ordered()
+        best = min(candidates, key=lambda d: d.mean_ms)
+        print(f"✓ Auto detector strategy picked '{best.name}' ({best.mean_ms:.1f} ms/frame)")
+        return [best]
+
+    def stats(self):
+        info = {
+            'strategy': self.strategy,
+            'available': list(self.detectors),
+            'detectors': {name: d.stats() for name, d in self.detectors.items()}
+        }
+        if self.strategy == 'auto':
+            info['auto'] = {
+                'recall_target': self.recall_target,
+                'warmup_frames': self.warmup_frames,
+                'profiled': self.profiled,
+                'positives': self.positives,
+                'recall': {name: (n / self.positives if self.positives else None)
+                           for name, n in self.found.items()},
+                'chosen': [d.name for d in self.chosen] if self.chosen else None
+            }
+        return info
@@ -0,0 +1,438 @@
+# encoders.py - Face encoder backends and the registry that probes them once at startup
+import os
+import threading
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+
+from lbp import get_lbp_engine, chi_square_distance
+from frame_context import FrameContext
+
+# Feature-based descriptor layouts: 96 color-histogram bins + LBP histogram + 20 edge bins,
+# or, for gridded descriptors, per-cell LBP histograms only (compared with chi-square).
+# 'lbp256' is the original layout; templates keep the name they were built with.
+FEATURE_DESCRIPTORS = {
+    'lbp256': {'radius': 2, 'points': 16, 'mode': 'legacy'},   # 372 floats
+    'uniform': {'radius': 2, 'points': 8, 'mode': 'uniform'},  # 175 floats
+    'riu2': {'radius': 2, 'points': 16, 'mode': 'riu2'},       # 134 floats
+    'lbph': {'radius': 1, 'points': 8, 'mode': 'uniform', 'grid': (8, 8)},  # 3776 floats
+}
+# Chi-square LBPH distances are much more compressed than weighted-euclidean ones:
+# shifted crops of the same face score about 0.10-0.16 but unrelated crops only
+# about 0.45, well under the shared threshold (0.55 by default). The threshold is
+# scaled for them so 0.55 becomes 0.20.
+LBPH_THRESHOLD_SCALE = 0.20 / 0.55
+COLOR_FEATURES = 96
+EDGE_FEATURES = 20
+DEEP_LEARNING_SIZE = 128
+# Where the five YuNet landmarks land in a 112x112 SFace/ArcFace input
+# (right eye, left eye, nose tip, right and left mouth corners)
+ALIGNMENT_TEMPLATE_112 = np.array([
+    [38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366],
+    [41.5493, 92.3655], [70.7299, 92.2041]
+], dtype=np.float32)
+
+
+def feature_descriptor_size(descriptor):
+    """Number of floats in a feature_based encoding for the given descriptor"""
+    params = dict(FEATURE_DESCRIPTORS[descriptor])
+    grid = params.pop('grid', None)
+    bins = get_lbp_engine(**params).bins
+    if grid:
+        return grid[0] * grid[1] * bins
+    return COLOR_FEATURES + bins + EDGE_FEATURES
+
+
+def lbp_features(image, radius=2, points=16, mode='legacy'):
+    """Extract Local Binary Pattern features"""
+    engine = get_lbp_engine(radius, points, mode)
+    try:
+        return engine.histogram(image)
+    except:
+        return np.zeros(engine.bins)
+
+
+def feature_weights(dim):
+    """Per-dimension weights of the weighted_euclidean metric"""
+    weights = np.ones(dim)
+    if dim > COLOR_FEATURES:  # If we have LBP features
+        weights[COLOR_FEATURES:] = 2.0  # Double weight for LBP features
+    return weights
+
+
+def compute_distance(metric, probe, gallery, cells=1):
+    """Distance from one encoding to another, or to each row of a (N, D) gallery"""
+    probe = np.asarray(probe)
+    gallery = np.asarray(gallery)
+    if metric == 'euclidean':
+        return np.linalg.norm(gallery - probe, axis=-1)
+    if metric == 'cosine':
+        norms = np.linalg.norm(gallery, axis=-1) * np.linalg.norm(probe)
+        return 1.0 - (gallery @ probe) / np.maximum(norms, 1e-12)
+    if metric == 'chi_square':
+        return chi_square_distance(probe, gallery, cells=cells)
+    if metric == 'weighted_euclidean':
+        weighted_diff = feature_weights(probe.shape[-1]) * (gallery - probe)
+        return np.sqrt(np.sum(weighted_diff ** 2, axis=-1))
+    raise ValueError(f"Unknown distance metric '{metric}'")
+
+
+def compute_pairwise_distance(metric, probes, gallery, cells=1):
+    """Row-wise distances: probes[i] to gallery[i] for two (N, D) arrays"""
+    probes = np.asarray(probes, dtype=np.float64)
+    gallery = np.asarray(gallery, dtype=np.float64)
+    if metric == 'euclidean':
+        return np.linalg.norm(gallery - probes, axis=-1)
+    if metric == 'cosine':
+        norms = np.linalg.norm(gallery, axis=-1) * np.linalg.norm(probes, axis=-1)
+        return 1.0 - np.einsum('ij,ij->i', gallery, probes) / np.maximum(norms, 1e-12)
+    if metric == 'weighted_euclidean':
+        weighted_diff = feature_weights(probes.shape[-1]) * (gallery - probes)
+        return np.sqrt(np.sum(weighted_diff ** 2, axis=-1))
+    if metric == 'chi_square':
+        return chi_square_distance(probes, np.atleast_2d(gallery), cells=cells)
+    raise ValueError(f"Unknown distance metric '{metric}'")
+
+
+class FaceEncoder(ABC):
+    """Common interface for encoder backends
+
+    `name` is the value stored as 'method' in known_faces. `encode` takes a
+    list of BGR face crops and returns one encoding (or None) per crop.
+    Constructors raise if the backend can't run here; the registry treats
+    that as "unavailable" and never retries it.
+    """
+    name = None
+    dim = None
+    metric = 'euclidean'
+
+    @abstractmethod
+    def encode(self, crops, **options):
+        """One encoding (or None) per BGR face crop"""
+
+    def encode_frame(self, frame, boxes, **options):
+        """Encode every (x, y, w, h) box of a FrameContext in one call"""
+        return self.encode_faces([(frame, box) for box in boxes], **options)
+
+    def encode_faces(self, faces, **options):
+        """Encode (FrameContext, box) pairs from any number of frames in one call"""
+        return self.encode([frame.crop(box) for frame, box in faces], **options)
+
+    def distance(self, probe, gallery, descriptor=None):
+        return compute_distance(self.metric, probe, gallery)
+
+    def metric_params(self, descriptor=None):
+        """(metric, per-dimension weights or None, histogram cells) for stored templates"""
+        return self.metric, None, 1
+
+    def threshold_scale(self, descriptor=None):
+        """Factor applied to the verification threshold for this backend's distances"""
+        return 1.0
+
+    def info(self):
+        return {'dim': self.dim, 'metric': self.metric}
+
+
+class FaceRecognitionEncoder(FaceEncoder):
+    """dlib ResNet embeddings via the face_recognition package
+
+    Face locations are always passed in, so dlib never re-runs its own HOG
+    detector on regions detect_faces already found. num_jitters trades
+    latency for accuracy (1 = single pass); landmark_model is 'small' (5
+    points, faster) or 'large' (68 points).
+    """
+    name = 'deep_learning'
+    dim = DEEP_LEARNING_SIZE
+    metric = 'euclidean'
+
+    def __init__(self, num_jitters=1, landmark_model='small', **config):
+        import face_recognition
+        if landmark_model not in ('small', 'large'):
+            raise ValueError(f"Unknown landmark model '{landmark_model}'")
+        self.face_recognition = face_recognition
+        self.num_jitters = max(1, int(num_jitters))
+        self.landmark_model = landmark_model
+
+    def info(self):
+        return {'dim': self.dim, 'metric': self.metric,
+                'num_jitters': self.num_jitters, 'landmark_model': self.landmark_model}
+
+    def _encode_locations(self, rgb_image, locations):
+        try:
+            found = self.face_recognition.face_encodings(
+                rgb_image,
+                known_face_locations=locations,
+                num_jitters=self.num_jitters,
+                model=self.landmark_model
+            )
+            return list(found) if len(found) == len(locations) else [None] * len(locations)
+        except Exception as e:
+            print(f"Deep learning encoding failed: {e}")
+            return [None] * len(locations)
+
+    def encode(self, crops, **options):
+        # Each crop is already a face: its location is the whole image
+        return [self._encode_locations(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB),
+                                       [(0, crop.shape[1], crop.shape[0], 0)])[0]
+                for crop in crops]
+
+    def encode_frame(self, frame, boxes, **options):
+        if len(boxes) == 0:
+            return []
+        # face_recognition wants (top, right, bottom, left)
+        locations = [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in boxes]
+        return self._encode_locations(frame.rgb, locations)
+
+    def encode_faces(self, faces, **options):
+        # dlib batches within an image only: one call per distinct frame
+        by_frame = {}
+        for i, (frame, box) in enumerate(faces):
+            by_frame.setdefault(id(frame), (frame, []))[1].append((i, box))
+        encodings = [None] * len(faces)
+        for frame, items in by_frame.values():
+            found = self.encode_frame(frame, [box for _, box in items], **options)
+            for (i, _), encoding in zip(items, found):
+                encodings[i] = encoding
+        return encodings
+
+
+class OnnxEmbeddingEncoder(FaceEncoder):
+    """Face embeddings from an ONNX model on OpenCV's DNN module (SFace by default)
+
+    Needs no dlib: the model is read from a local file the same way
+    load_dnn_model finds the SSD detector, and runs on CPU. All crops of a
+    call go through one forward pass when the model has a dynamic batch
+    dimension; fixed-batch models are detected on first use and run per crop.
+    A user-supplied model is stored under its own method name so its
+    templates are never compared against another model's. When detect_faces
+    supplies landmarks (YuNet), SFace crops are similarity-aligned to the
+    template it was trained on instead of being stretched from the box.
+    """
+    name = 'sface'
+    metric = 'cosine'
+    default_model = 'face_recognition_sface_2021dec.onnx'
+
+    def __init__(self, embedding_model=None, embedding_input_size=112, **config):
+        model_file = embedding_model or self.default_model
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(
+                f"{model_file} not found (SFace: https://github.com/opencv/opencv_zoo/raw/main/"
+                f"models/face_recognition_sface/face_recognition_sface_2021dec.onnx)"
+            )
+
+        self.net = cv2.dnn.readNetFromONNX(model_file)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        if embedding_model:
+            self.name = 'onnx:' + os.path.splitext(os.path.basename(model_file))[0]
+        self.model_file = model_file
+        self.input_size = (int(embedding_input_size), int(embedding_input_size))
+        self.batching = True
+        # Only SFace is known to expect ALIGNMENT_TEMPLATE_112 inputs
+        self.align = not embedding_model and self.input_size == (112, 112)
+        # cv2.dnn.Net is not safe to run from several Flask threads at once
+        self._lock = threading.Lock()
+
+        # One forward pass at startup: learns the embedding size and makes a
+        # broken model fail here instead of on the first verification
+        blank = np.zeros((self.input_size[1], self.input_size[0], 3), dtype=np.uint8)
+        self.dim = int(self._forward([blank]).shape[1])
+        print(f"✓ Loaded face embedding model {model_file} ({self.dim}-d)")
+
+    def info(self):
+        return {'dim': self.dim, 'metric': self.metric, 'model': self.model_file,
+                'input_size': list(self.input_size), 'batching': self.batching, 'align': self.align}
+
+    def aligned_crop(self, frame, landmarks):
+        """112x112 crop warped so the five landmarks match ALIGNMENT_TEMPLATE_112"""
+        matrix, _ = cv2.estimateAffinePartial2D(np.asarray(landmarks, dtype=np.float32),
+                                                ALIGNMENT_TEMPLATE_112, method=cv2.LMEDS)
+        if matrix is None:
+            return None
+        return cv2.warpAffine(frame, matrix, self.input_size)
+
+    def encode_faces(self, faces, **options):
+        crops = []
+        for frame, box in faces:
+            landmarks = getattr(box, 'landmarks', None)
+            crop = self.aligned_crop(frame.image, landmarks) if self.align and landmarks is not None else None
+            crops.append(crop if crop is not None else frame.crop(box))
+        return self.encode(crops, **options)
+
+    def _forward(self, crops):
+        # Same preprocessing as cv2.FaceRecognizerSF: RGB, no mean, no scaling
+        blob = cv2.dnn.blobFromImages(crops, 1.0, self.input_size, (0, 0, 0), swapRB=True, crop=False)
+        with self._lock:
+            if self.batching:
+                try:
+                    self.net.setInput(blob)
+                    return self.net.forward().reshape(len(crops), -1)
+                except cv2.error:
+                    if len(crops) == 1:
+                        raise
+                    print("⚠ Embedding model has a fixed batch size; encoding crops one at a time")
+                    self.batching = False
+
+            rows = []
+            for i in range(len(crops)):
+                self.net.setInput(blob[i:i+1])
+                rows.append(self.net.forward().reshape(-1))
+            return np.stack(rows)
+
+    def encode(self, crops, **options):
+        valid = [i for i, crop in enumerate(crops) if crop is not None and crop.size > 0]
+        encodings = [None] * len(crops)
+        if not valid:
+            return encodings
+
+        try:
+            embeddings = self._forward([crops[i] for i in valid])
+        except Exception as e:
+            print(f"Embedding model failed: {e}")
+            return encodings
+
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        for row, i in enumerate(valid):
+            encodings[i] = embeddings[row]
+        return encodings
+
+
+class FeatureEncoder(FaceEncoder):
+    """Color/LBP/edge histograms; always available"""
+    name = 'feature_based'
+
+    def __init__(self, descriptor='uniform', **config):
+        if descriptor not in FEATURE_DESCRIPTORS:
+            raise ValueError(f"Unknown feature descriptor '{descriptor}'")
+        self.descriptor = descriptor
+        self.dim = feature_descriptor_size(descriptor)
+        self.metric = self.metric_for(descriptor)
+
+    @staticmethod
+    def metric_for(descriptor):
+        return 'chi_square' if FEATURE_DESCRIPTORS[descriptor].get('grid') else 'weighted_euclidean'
+
+    def distance(self, probe, gallery, descriptor=None):
+        metric, _, cells = self.metric_params(descriptor)
+        return compute_distance(metric, probe, gallery, cells=cells)
+
+    def metric_params(self, descriptor=None):
+        descriptor = descriptor or self.descriptor
+        metric = self.metric_for(descriptor)
+        grid = FEATURE_DESCRIPTORS[descriptor].get('grid')
+        cells = grid[0] * grid[1] if grid else 1
+        weights = feature_weights(feature_descriptor_size(descriptor)) if metric == 'weighted_euclidean' else None
+        return metric, weights, cells
+
+    def threshold_scale(self, descriptor=None):
+        return LBPH_THRESHOLD_SCALE if self.metric_for(descriptor or self.descriptor) == 'chi_square' else 1.0
+
+    def info(self):
+        return {'dim': self.dim, 'metric': self.metric, 'descriptor': self.descriptor}
+
+    def encode(self, crops, descriptor=None, **options):
+        return [self.encode_one(crop, descriptor) for crop in crops]
+
+    def encode_one(self, face_image, descriptor=None):
+        try:
+            params = dict(FEATURE_DESCRIPTORS[descriptor or self.descriptor])
+            grid = params.pop('grid', None)
+            face_resized = cv2.resize(face_image, (128, 128))
+            gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
+
+            if grid:
+                # Spatial LBPH: cell histograms only, all cells from one pass
+                return get_lbp_engine(**params).grid_histogram(gray, grid)
+
+            # Extract multiple features
+            features = []
+
+            # Color histogram for each channel
+            for channel in range(3):
+                hist = cv2.calcHist([face_resized], [channel], None, [32], [0, 256])
+                if hist is not None:
+                    hist = cv2.normalize(hist, hist).flatten()
+                    features.extend(hist)
+
+            # LBP features
+            features.extend(lbp_features(gray, **params))
+
+            # Edge features
+            edges = cv2.Canny(gray, 100, 200)
+            edge_hist, _ = np.histogram(edges.flatten(), bins=20, range=(0, 256))
+            edge_hist = edge_hist.astype("float")
+            if edge_hist.sum() > 0:
+                edge_hist /= edge_hist.sum()
+            features.extend(edge_hist)
+
+            return np.array(features)
+        except Exception as e:
+            print(f"Feature-based encoding failed: {e}")
+            return None
+
+
+# Probe order is preference order; feature_based must stay last as the fallback
+ENCODER_BACKENDS = [FaceRecognitionEncoder, OnnxEmbeddingEncoder, FeatureEncoder]
+
+
+class EncoderRegistry:
+    """Backends probed once; callers look encoders up by the 'method' name"""
+
+    def __init__(self, preferred=None, **config):
+        self.backends = {}
+        self.unavailable = {}
+        for backend in ENCODER_BACKENDS:
+            try:
+                encoder = backend(**config)
+                self.backends[encoder.name] = encoder
+            except Exception as e:
+                self.unavailable[backend.name] = f"{type(e).__name__}: {e}"
+
+        if preferred and preferred in self.backends:
+            self.active = preferred
+        else:
+            if preferred:
+                print(f"⚠ Encoder '{preferred}' not available, using best available backend")
+            self.active = next(iter(self.backends))
+
+        self.fallback = self.backends[FeatureEncoder.name]
+
+    def get(self, method=None):
+        """Encoder for a stored method name (the active one by default), or None"""
+        return self.backends.get(method or self.active)
+
+    def encode(self, crops, method=None, **options):
+        """Encode crops with one backend, returning [(encoding, method) or (None, 'error')]"""
+        encoder = self.get(method)
+        if encoder is None:
+            return [(None, 'unavailable')] * len(crops)
+        return self._tag(encoder, encoder.encode(crops, **options))
+
+    def encode_frame(self, frame, boxes, method=None, **options):
+        """Encode all boxes of a frame (array or FrameContext) in one backend call, same result format as encode()"""
+        encoder = self.get(method)
+        if encoder is None:
+            return [(None, 'unavailable')] * len(boxes)
+        return self._tag(encoder, encoder.encode_frame(FrameContext.of(frame), boxes, **options))
+
+    def encode_faces(self, faces, method=None, **options):
+        """Encode (frame, box) pairs from several frames in one backend call, same result format"""
+        encoder = self.get(method)
+        if encoder is None:
+            return [(None, 'unavailable')] * len(faces)
+        faces = [(FrameContext.of(frame), box) for frame, box in faces]
+        return self._tag(encoder, encoder.encode_faces(faces, **options))
+
+    @staticmethod
+    def _tag(encoder, encodings):
+        return [
+            (encoding, encoder.name) if encoding is not None else (None, 'error')
+            for encoding in encodings
+        ]
+
+    def status(self):
+        return {
+            'active': self.active,
+            'backends': {name: encoder.info() for name, encoder in self.backends.items()},
+            'unavailable': self.unavailable,
+        }
@@ -0,0 +1,119 @@
+# encoding_cache.py - Content-addressed LRU cache for detections and encodings
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Rough per-entry bookkeeping cost (key, OrderedDict node, tuple) on top of array bytes
+ENTRY_OVERHEAD = 256
+
+
+def array_digest(array):
+    """Fast content hash of an image (shape and dtype included)"""
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((array.shape, array.dtype.str)).encode())
+    h.update(array.data)
+    return h.digest()
+
+
+def value_size(value):
+    """Approximate bytes held by a cached value"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(v) for v in value) + 8 * len(value)
+    if isinstance(value, dict):
+        return sum(value_size(v) for v in value.values()) + 64 * len(value)
+    return 32
+
+
+class EncodingCache:
+    """LRU cache bounded by entry count and total bytes, with a per-entry TTL
+
+    Keys are built with `key()` from a content digest plus whatever pipeline
+    configuration produced the value, so a config change never serves stale
+    results. max_entries=0 disables the cache.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(kind, digest, *config):
+        return (kind, digest) + tuple(config)
+
+    def get(self, key):
+        """Cached value or None; refreshes LRU position on a hit"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        size = value_size(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,91 @@
+# frame_context.py - One frame plus everything derived from it, each computed at most once
+import threading
+import cv2
+
+from encoding_cache import array_digest
+
+
+class FrameContext:
+    """A BGR frame and its lazily computed derived representations
+
+    Grayscale, RGB, content digest, detector proxies and blobs, detections
+    and per-face encodings are all memoized here, so every stage and
+    endpoint handling the same frame shares one copy of each. Derived
+    images are read-only by convention: callers that need to draw on one
+    must copy it.
+
+    Each memo key has its own lock, so concurrent stages (e.g. detectors
+    racing on one proxy) never compute the same value twice and a stage
+    computing one value never blocks another.
+
+    `scale` is the image's size relative to the full-resolution frame it
+    was derived from (below 1 for detector proxies).
+    """
+
+    def __init__(self, image, source=None, scale=1.0):
+        self.image = image
+        self.source = source
+        self.scale = scale
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, frame, source=None):
+        """Wrap a raw frame; an existing context is returned unchanged"""
+        return frame if isinstance(frame, FrameContext) else cls(frame, source)
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def memo(self, key, compute):
+        """Value for key, calling compute() only the first time it is asked for"""
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._lock:
+                if key in self._values:
+                    return self._values[key]
+            value = compute()
+            with self._lock:
+                self._values[key] = value
+            return value
+
+    @property
+    def digest(self):
+        return self.memo('digest', lambda: array_digest(self.image))
+
+    @property
+    def gray(self):
+        return self.memo('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def rgb(self):
+        return self.memo('rgb', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
+
+    def proxy(self, width):
+        """(context of a copy at most `width` pixels wide, scale = proxy / full)"""
+        height, full_width = self.image.shape[:2]
+        if not width or full_width <= width:
+            # Not memoized: a context holding itself would only be freed by the cyclic GC
+            return self, 1.0
+
+        def compute():
+            scale = width / full_width
+            image = cv2.resize(self.image, (width, max(1, int(round(height * scale)))),
+                               interpolation=cv2.INTER_AREA)
+            return FrameContext(image, self.source, self.scale * scale), scale
+        return self.memo(('proxy', width), compute)
+
+    def blob(self, size, mean=(0, 0, 0), swap_rb=False):
+        """cv2.dnn blob of the whole image resized to size"""
+        return self.memo(('blob', size, mean, swap_rb), lambda: cv2.dnn.blobFromImage(
+            cv2.resize(self.image, size), 1.0, size, mean, swapRB=swap_rb))
+
+    def crop(self, box):
+        """View of an (x, y, w, h) box; no pixels are copied"""
+        x, y, w, h = box
+        return self.image[y:y+h, x:x+w]
@@ -0,0 +1,290 @@
+# frame_sources.py - Camera, video file, image directory and synthetic frame sources
+#
+# Every source has the slice of the cv2.VideoCapture interface the camera
+# service uses (read, isOpened, release) plus info(). read(image=buf) fills
+# a caller-provided buffer when its shape and dtype fit, like
+# VideoCapture.read, and returns a new array otherwise. Sources that are not
+# a live device pace read() to their fps, so the pipeline sees the same
+# timing it would from a camera and runs deterministically without one.
+#
+# Source specs (FACE_SOURCE):
+#   camera:0 (or just 0)   camera index
+#   video:/path/clip.mp4   video file, looped
+#   images:/path/dir       sorted image files, looped at FACE_SOURCE_FPS
+#   synthetic[:WxH]        generated in-memory frames
+# A bare path picks video or images depending on whether it is a directory.
+import os
+import time
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def copy_into(frame, image=None):
+    """frame copied into image when it fits, else a new copy (VideoCapture.read semantics)"""
+    if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+        np.copyto(image, frame)
+        return image
+    return frame.copy()
+
+
+class FrameSource(ABC):
+    """Base for sources that are not a live device"""
+    kind = None
+
+    def __init__(self, fps=10.0, loop=True):
+        self.fps = float(fps)
+        self.loop = loop
+        self.opened = True
+        self.next_at = None
+
+    def _pace(self):
+        """Sleep until this frame is due, like a camera delivering at fps"""
+        if self.fps <= 0:
+            return
+        now = time.monotonic()
+        if self.next_at is None or now - self.next_at > 1.0:
+            # First frame, or the reader fell far behind: don't burst to catch up
+            self.next_at = now
+        elif self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at += 1.0 / self.fps
+
+    @abstractmethod
+    def _next_frame(self, image=None):
+        """Next frame (filled into image when it fits), or None when there is none"""
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+        frame = self._next_frame(image)
+        if frame is None:
+            return False, None
+        self._pace()
+        return True, frame
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.opened = False
+
+    def info(self):
+        return {'kind': self.kind, 'fps': self.fps, 'loop': self.loop}
+
+
+def fourcc_string(code):
+    """'MJPG' for the integer CAP_PROP_FOURCC reports, None when the driver reports none"""
+    code = int(code)
+    if code <= 0:
+        return None
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+class CameraSource:
+    """Live camera by index; the device itself paces read()
+
+    Capture properties are requested at open time (FOURCC first, since
+    some drivers only offer larger sizes or higher rates once it is set)
+    and read back, because drivers silently fall back to the nearest mode
+    they support. None leaves a property at the driver default. A
+    CAP_PROP_BUFFERSIZE of 1 keeps the driver from queueing stale frames.
+    """
+    kind = 'camera'
+
+    def __init__(self, index=0, width=None, height=None, fourcc=None, fps=None, buffer_size=None):
+        self.index = index
+        self.cap = cv2.VideoCapture(index)
+        self.requested = {'width': width, 'height': height, 'fourcc': fourcc,
+                          'fps': fps, 'buffer_size': buffer_size}
+        self.negotiated = {}
+        if self.cap.isOpened():
+            self.negotiate()
+
+    def negotiate(self):
+        """Apply the requested capture properties and read back what the driver chose"""
+        requested = self.requested
+        settings = [
+            (cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*requested['fourcc']) if requested['fourcc'] else None),
+            (cv2.CAP_PROP_FRAME_WIDTH, requested['width']),
+            (cv2.CAP_PROP_FRAME_HEIGHT, requested['height']),
+            (cv2.CAP_PROP_FPS, requested['fps']),
+            (cv2.CAP_PROP_BUFFERSIZE, requested['buffer_size']),
+        ]
+        for prop, value in settings:
+            if value:
+                try:
+                    self.cap.set(prop, value)
+                except cv2.error:
+                    pass
+
+        self.negotiated = {
+            'width': int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fourcc': fourcc_string(self.cap.get(cv2.CAP_PROP_FOURCC)),
+            'fps': float(self.cap.get(cv2.CAP_PROP_FPS)),
+            # 0 / -1 when the backend doesn't support the property
+            'buffer_size': int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+        }
+        mismatched = [name for name, value in requested.items()
+                      if value and self.negotiated[name] != value]
+        if mismatched:
+            print(f"⚠ Camera ignored requested {', '.join(mismatched)}: using {self.negotiated}")
+        else:
+            print(f"✓ Camera negotiated {self.negotiated}")
+        return self.negotiated
+
+    def read(self, image=None):
+        return self.cap.read(image=image) if image is not None else self.cap.read()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    def info(self):
+        return {'kind': self.kind, 'index': self.index,
+                'requested': self.requested, 'negotiated': self.negotiated}
+
+
+class VideoFileSource(FrameSource):
+    """Frames of a video file at its own frame rate (or fps), rewound at the end when looping"""
+    kind = 'video'
+
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        file_fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0
+        super().__init__(fps or file_fps or 30.0, loop)
+        self.opened = self.cap.isOpened()
+
+    def _next_frame(self, image=None):
+        ret, frame = self.cap.read(image=image) if image is not None else self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(image=image) if image is not None else self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+    def info(self):
+        return {**super().info(), 'path': self.path}
+
+
+class ImageDirectorySource(FrameSource):
+    """Image files of a directory in name order, decoded on demand"""
+    kind = 'images'
+
+    def __init__(self, path, fps=10.0, loop=True):
+        super().__init__(fps, loop)
+        self.path = path
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ) if os.path.isdir(path) else []
+        self.position = 0
+        self.opened = bool(self.files)
+
+    def _next_frame(self, image=None):
+        # Skip unreadable files, but give up after one full pass without a frame
+        for _ in range(len(self.files)):
+            if self.position >= len(self.files):
+                if not self.loop:
+                    return None
+                self.position = 0
+            frame = cv2.imread(self.files[self.position])
+            self.position += 1
+            if frame is not None:
+                return copy_into(frame, image)
+        return None
+
+    def info(self):
+        return {**super().info(), 'path': self.path, 'images': len(self.files)}
+
+
+class SyntheticSource(FrameSource):
+    """In-memory frames: the given arrays in turn, or generated textured frames
+
+    Generated frames are deterministic for a seed (a noise texture shifted a
+    few pixels each frame), so benchmarks without a camera are repeatable.
+    They contain no faces: they exercise capture and detection timing only.
+    To run register/verify end to end without a camera, pass frames of a
+    face, or use images:/video: with recordings of one.
+    """
+    kind = 'synthetic'
+
+    def __init__(self, frames=None, width=640, height=480, fps=30.0, loop=True, seed=0):
+        super().__init__(fps, loop)
+        if frames is None:
+            rng = np.random.default_rng(seed)
+            base = rng.integers(0, 256, (height, width + 64, 3), dtype=np.uint8)
+            base = cv2.GaussianBlur(base, (0, 0), 3)
+            frames = [np.ascontiguousarray(base[:, shift:shift + width]) for shift in range(0, 64, 4)]
+        self.frames = list(frames)
+        self.position = 0
+        self.opened = bool(self.frames)
+
+    def _next_frame(self, image=None):
+        if self.position >= len(self.frames):
+            if not self.loop:
+                return None
+            self.position = 0
+        frame = self.frames[self.position]
+        self.position += 1
+        # Never hand out the stored frame itself
+        return copy_into(frame, image)
+
+    def info(self):
+        height, width = self.frames[0].shape[:2] if self.frames else (0, 0)
+        return {**super().info(), 'frames': len(self.frames), 'resolution': f'{width}x{height}'}
+
+
+class UnavailableSource(FrameSource):
+    """Stand-in for a source that could not be opened; never delivers a frame"""
+    kind = 'unavailable'
+
+    def __init__(self, spec, error):
+        super().__init__(fps=0, loop=False)
+        self.spec = spec
+        self.error = error
+        self.opened = False
+
+    def _next_frame(self, image=None):
+        return None
+
+    def info(self):
+        return {'kind': self.kind, 'spec': self.spec, 'error': self.error}
+
+
+def open_frame_source(spec='camera:0', fps=None, capture=None):
+    """FrameSource for a FACE_SOURCE spec (see the header of this file)
+
+    `capture` holds CameraSource properties (width, height, fourcc, fps,
+    buffer_size); it only applies to cameras. Raises ValueError for a
+    malformed spec.
+    """
+    spec = str(spec).strip()
+    kind, _, arg = spec.partition(':')
+    if spec.isdigit():
+        kind, arg = 'camera', spec
+    elif kind not in ('camera', 'video', 'images', 'synthetic'):
+        kind, arg = ('images' if os.path.isdir(spec) else 'video'), spec
+
+    if kind == 'camera':
+        if arg and not arg.isdigit():
+            raise ValueError(f"Invalid camera index in frame source '{spec}'")
+        return CameraSource(int(arg or 0), **(capture or {}))
+    if kind == 'video':
+        return VideoFileSource(arg, fps=fps)
+    if kind == 'images':
+        return ImageDirectorySource(arg, fps=fps or 10.0)
+    try:
+        width, height = (int(v) for v in arg.split('x')) if arg else (640, 480)
+    except ValueError:
+        raise ValueError(f"Invalid synthetic resolution in frame source '{spec}', expected WxH")
+    return SyntheticSource(width=width, height=height, fps=fps or 30.0)
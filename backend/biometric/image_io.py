@@ -0,0 +1,34 @@
+# image_io.py - Decoding uploaded images straight from request bytes
+import base64
+import cv2
+import numpy as np
+
+# IMREAD_REDUCED_* decode JPEGs at 1/2, 1/4 or 1/8 size directly in the
+# decoder (DCT scaling), much faster than a full decode plus resize
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def image_bytes_from_base64(text):
+    """Raw bytes of a base64 image, with or without a data: URL prefix"""
+    if ',' in text[:100] and text.startswith('data:'):
+        text = text.split(',', 1)[1]
+    return base64.b64decode(text)
+
+
+def decode_image(data, reduce=1):
+    """BGR image decoded from encoded bytes (JPEG/PNG/...) without a temporary file
+
+    `reduce` is 1, 2, 4 or 8; returns None when the bytes are not an image.
+    """
+    if reduce not in REDUCED_DECODE_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(REDUCED_DECODE_FLAGS)}")
+    if not data:
+        return None
+    # frombuffer wraps the request bytes; imdecode reads them in place
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[reduce])
@@ -0,0 +1,217 @@
+# lbp.py - Local Binary Pattern kernels for the feature-based face encoder
+import functools
+import numpy as np
+
+# legacy:  integer-truncated sampling, codes stored in uint8 (original encoder)
+# default: bilinear sampling, one bin per code (2**points bins)
+# uniform: bilinear sampling, uniform patterns get their own bin, the rest share one
+# riu2:    bilinear sampling, rotation-invariant uniform patterns (points + 2 bins)
+LBP_MODES = ('legacy', 'default', 'uniform', 'riu2')
+
+# Bilinear samples of a flat patch can land a hair below the centre value
+COMPARE_TOLERANCE = 1e-3
+
+
+def _popcount(values, bits):
+    count = np.zeros_like(values)
+    for b in range(bits):
+        count += (values >> b) & 1
+    return count
+
+
+class LBPEngine:
+    """Circular LBP with sampling geometry and bin lookup computed once per configuration"""
+
+    def __init__(self, radius=2, points=8, mode='uniform'):
+        if mode not in LBP_MODES:
+            raise ValueError(f"Unknown LBP mode '{mode}', expected one of {LBP_MODES}")
+        if mode != 'legacy' and points > 16:
+            raise ValueError("Bilinear LBP supports at most 16 sampling points")
+
+        self.radius = radius
+        self.points = points
+        self.mode = mode
+        self.margin = int(np.ceil(radius))
+        self.taps = self._bilinear_taps()
+        self.lookup, self.bins = self._bin_lookup()
+        # Legacy offsets depend on the image shape (border rows round differently)
+        self._legacy_geometry = {}
+        # Per (code shape, grid): cell index of every code pixel, pre-multiplied by bins
+        self._cell_offsets = {}
+
+    def _bilinear_taps(self):
+        """Per sampling point: (dy, dx, weight) for each pixel with non-zero weight"""
+        taps = []
+        for p in range(self.points):
+            angle = 2 * np.pi * p / self.points
+            y = -self.radius * np.sin(angle)
+            x = self.radius * np.cos(angle)
+            # Snap float noise so axis-aligned points read a single pixel
+            if abs(y - round(y)) < 1e-6:
+                y = float(round(y))
+            if abs(x - round(x)) < 1e-6:
+                x = float(round(x))
+
+            fy, fx = int(np.floor(y)), int(np.floor(x))
+            ty, tx = y - fy, x - fx
+            corners = (
+                (fy, fx, (1 - ty) * (1 - tx)),
+                (fy, fx + 1, (1 - ty) * tx),
+                (fy + 1, fx, ty * (1 - tx)),
+                (fy + 1, fx + 1, ty * tx),
+            )
+            taps.append(tuple((dy, dx, np.float32(w)) for dy, dx, w in corners if w > 1e-6))
+        return taps
+
+    def _bin_lookup(self):
+        """Code -> histogram bin table, or None when codes are used directly"""
+        if self.mode == 'legacy':
+            return None, 256
+        if self.mode == 'default':
+            return None, 2 ** self.points
+
+        P = self.points
+        codes = np.arange(2 ** P, dtype=np.int64)
+        rotated = (codes >> 1) | ((codes & 1) << (P - 1))
+        uniform = _popcount(codes ^ rotated, P) <= 2
+
+        if self.mode == 'uniform':
+            bins = P * (P - 1) + 3
+            lookup = np.full(codes.shape, bins - 1, dtype=np.intp)
+            lookup[uniform] = np.arange(np.count_nonzero(uniform))
+        else:
+            bins = P + 2
+            lookup = np.where(uniform, _popcount(codes, P), P + 1).astype(np.intp)
+        return lookup, bins
+
+    def _legacy_offsets(self, height, width):
+        key = (height, width)
+        if key not in self._legacy_geometry:
+            radius = self.radius
+            rows = np.arange(radius, height - radius)
+            cols = np.arange(radius, width - radius)
+            offsets = []
+            for p in range(self.points):
+                angle = 2 * np.pi * p / self.points
+                # Same float expression and int() truncation as the original
+                # per-pixel loop, so border rows where cos/sin round across an
+                # integer sample the same neighbour as before
+                xs = (cols + radius * np.cos(angle)).astype(np.intp)
+                ys = (rows - radius * np.sin(angle)).astype(np.intp)
+                dx = xs - cols
+                dy = ys - rows
+
+                if dx.min() == dx.max() and dy.min() == dy.max() and \
+                        radius + dx[0] >= 0 and radius + dy[0] >= 0 and \
+                        dx[0] <= radius and dy[0] <= radius:
+                    # Constant offset: the neighbour plane is a plain shifted view
+                    offsets.append(('slice', radius + dy[0], radius + dx[0]))
+                else:
+                    # Offset varies along the border: gather just this plane
+                    valid = ((ys >= 0) & (ys < height))[:, None] & ((xs >= 0) & (xs < width))[None, :]
+                    index = np.ix_(np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1))
+                    offsets.append(('gather', index, valid))
+            self._legacy_geometry[key] = offsets
+        return self._legacy_geometry[key]
+
+    def _legacy_codes(self, image):
+        height, width = image.shape
+        radius = self.radius
+        center = image[radius:height - radius, radius:width - radius]
+        rows, cols = center.shape
+        codes = np.zeros(center.shape, dtype=np.uint32)
+
+        for p, (kind, a, b) in enumerate(self._legacy_offsets(height, width)):
+            if kind == 'slice':
+                bits = image[a:a + rows, b:b + cols] >= center
+            else:
+                bits = (image[a] >= center) & b
+            codes |= bits.astype(np.uint32) << p
+
+        # The original implementation stored codes in a uint8 image, which
+        # keeps only the low eight bits. Legacy templates were built that way.
+        return codes.astype(np.uint8)
+
+    def codes(self, image):
+        """LBP code image for every pixel at least `margin` away from the border"""
+        if self.mode == 'legacy':
+            return self._legacy_codes(image)
+
+        height, width = image.shape
+        m = self.margin
+        if height <= 2 * m or width <= 2 * m:
+            raise ValueError("Image is smaller than the LBP neighbourhood")
+
+        img = image.astype(np.float32)
+        center = img[m:height - m, m:width - m]
+        codes = np.zeros(center.shape, dtype=np.uint32)
+
+        for p, taps in enumerate(self.taps):
+            plane = None
+            for dy, dx, weight in taps:
+                shifted = img[m + dy:height - m + dy, m + dx:width - m + dx]
+                plane = shifted * weight if plane is None else plane + shifted * weight
+            codes |= (plane >= center - COMPARE_TOLERANCE).astype(np.uint32) << p
+
+        return codes
+
+    def histogram(self, image):
+        """Normalized histogram of LBP codes (self.bins values)"""
+        codes = self.codes(image)
+        if self.lookup is not None:
+            codes = self.lookup[codes]
+        hist = np.bincount(codes.ravel(), minlength=self.bins).astype("float")
+        if hist.sum() > 0:
+            hist /= hist.sum()
+        return hist
+
+    def _grid_offsets(self, shape, grid):
+        key = (shape, grid)
+        if key not in self._cell_offsets:
+            rows, cols = shape
+            grid_y, grid_x = grid
+            cell_y = (np.arange(rows) * grid_y) // rows
+            cell_x = (np.arange(cols) * grid_x) // cols
+            cell = cell_y[:, None] * grid_x + cell_x[None, :]
+            self._cell_offsets[key] = (cell * self.bins).astype(np.intp)
+        return self._cell_offsets[key]
+
+    def grid_histogram(self, image, grid=(8, 8)):
+        """Spatial LBPH: per-cell normalized histograms, concatenated row-major"""
+        codes = self.codes(image)
+        if self.lookup is not None:
+            codes = self.lookup[codes]
+        cells = grid[0] * grid[1]
+        # One bincount over cell*bins + bin instead of a histogram per cell
+        index = self._grid_offsets(codes.shape, tuple(grid)) + codes
+        hist = np.bincount(index.ravel(), minlength=cells * self.bins).astype("float")
+        hist = hist.reshape(cells, self.bins)
+        totals = hist.sum(axis=1, keepdims=True)
+        np.divide(hist, totals, out=hist, where=totals > 0)
+        return hist.ravel()
+
+
+def chi_square_distance(probe, gallery, cells=1):
+    """Chi-square distance from one histogram to each row of a gallery
+
+    With per-cell normalized histograms the result is scaled to [0, 1] by
+    dividing by the number of cells. Returns a scalar for a 1-D gallery.
+    """
+    probe = np.asarray(probe, dtype=np.float64)
+    stacked = np.atleast_2d(np.asarray(gallery, dtype=np.float64))
+    num = (stacked - probe) ** 2
+    den = stacked + probe
+    terms = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+    distances = 0.5 * terms.sum(axis=1) / cells
+    return distances if np.ndim(gallery) > 1 else distances[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_lbp_engine(radius=2, points=8, mode='uniform'):
+    """Shared engine per configuration so geometry and lookup tables are built once"""
+    return LBPEngine(radius, points, mode)
+
+
+def lbp_histogram(image, radius=2, points=16):
+    """Normalized 256-bin histogram matching the original feature_based encoder"""
+    return get_lbp_engine(radius, points, 'legacy').histogram(image)
@@ -0,0 +1,175 @@
+# streaming.py - Verification sessions fed by client-pushed frames, latest frame wins
+import threading
+import time
+import uuid
+
+
+class StreamSession:
+    """Verifies one user against frames the client pushes as fast as it likes
+
+    push() only stores the encoded bytes in a single slot, replacing any
+    frame the worker has not picked up yet (counted as dropped), so a slow
+    server never builds a queue and stale frames are never even decoded.
+    The worker thread decodes and verifies whatever is newest, and the
+    session finishes on the first match or when the deadline passes.
+    """
+
+    def __init__(self, username, decode, verify, deadline_ms=5000, on_finish=None):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.decode = decode
+        self.verify = verify
+        self.deadline_ms = deadline_ms
+        self.on_finish = on_finish
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + deadline_ms / 1000.0
+        self.cond = threading.Condition()
+        self.slot = None
+        self.done = threading.Event()
+        self.outcome = None
+        self.best_distance = None
+        self.last_result = None
+        self.finished_at = None
+        self.error = None
+        # Metrics
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.decode_errors = 0
+        self.frame_ms = 0.0
+        self.thread = threading.Thread(target=self._run, name=f'stream-{self.id[:8]}', daemon=True)
+        self.thread.start()
+
+    def push(self, data):
+        """Offer an encoded frame; False once the session has finished"""
+        if self.done.is_set():
+            return False
+        with self.cond:
+            self.frames_received += 1
+            if self.slot is not None:
+                self.frames_dropped += 1
+            self.slot = data
+            self.cond.notify()
+        return True
+
+    def cancel(self):
+        self._finish('cancelled')
+
+    def _take(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.slot is not None or self.done.is_set(),
+                               max(0.0, self.deadline - time.monotonic()))
+            data, self.slot = self.slot, None
+            return data
+
+    def _run(self):
+        while not self.done.is_set():
+            if time.monotonic() >= self.deadline:
+                self._finish('deadline')
+                break
+            data = self._take()
+            if data is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                frame = self.decode(data)
+                if frame is None:
+                    with self.cond:
+                        self.decode_errors += 1
+                    continue
+                result = self.verify(frame)
+            except Exception as e:
+                with self.cond:
+                    self.error = str(e)
+                self._finish('error')
+                break
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self.cond:
+                self.frame_ms += elapsed_ms
+                self.frames_processed += 1
+                self.last_result = result
+                distance = result.get('distance')
+                if distance is not None and (self.best_distance is None or distance < self.best_distance):
+                    self.best_distance = distance
+            if result.get('verified'):
+                self._finish('match')
+
+    def _finish(self, outcome):
+        with self.cond:
+            if self.done.is_set():
+                return
+            self.outcome = outcome
+            self.finished_at = time.monotonic()
+            self.done.set()
+            self.cond.notify_all()
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def wait(self, timeout):
+        """Block until the session finishes or timeout; True if finished"""
+        return self.done.wait(timeout)
+
+    def status(self):
+        with self.cond:
+            return self._status()
+
+    def _status(self):
+        end = self.finished_at or time.monotonic()
+        return {
+            'session_id': self.id,
+            'username': self.username,
+            'done': self.done.is_set(),
+            'verified': self.outcome == 'match',
+            'outcome': self.outcome,
+            'error': self.error,
+            'distance': self.best_distance,
+            'last_outcome': self.last_result.get('outcome') if self.last_result else None,
+            'elapsed_ms': round((end - self.started_at) * 1000, 3),
+            'deadline_ms': self.deadline_ms,
+            'frames_received': self.frames_received,
+            'frames_dropped': self.frames_dropped,
+            'frames_processed': self.frames_processed,
+            'decode_errors': self.decode_errors,
+            'mean_frame_ms': round(self.frame_ms / self.frames_processed, 3) if self.frames_processed else None
+        }
+
+
+class StreamSessions:
+    """Open sessions by id; finished ones are kept for `keep_seconds` so clients can read the result"""
+
+    def __init__(self, max_sessions=32, keep_seconds=30.0):
+        self.max_sessions = max_sessions
+        self.keep_seconds = keep_seconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if session.finished_at is not None and now - session.finished_at > self.keep_seconds:
+                del self.sessions[session_id]
+
+    def open(self, *args, **kwargs):
+        """New StreamSession, or None when max_sessions are already running"""
+        with self.lock:
+            self._expire()
+            running = sum(1 for s in self.sessions.values() if not s.done.is_set())
+            if running >= self.max_sessions:
+                return None
+            session = StreamSession(*args, **kwargs)
+            self.sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def stats(self):
+        with self.lock:
+            self._expire()
+            return {
+                'open': sum(1 for s in self.sessions.values() if not s.done.is_set()),
+                'finished': sum(1 for s in self.sessions.values() if s.done.is_set()),
+                'max_sessions': self.max_sessions
+            }
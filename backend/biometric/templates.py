@@ -0,0 +1,120 @@
+# templates.py - Compact storage for registered face templates
+#
+# Storage modes (per template of D floats):
+#   float64  8*D bytes   templates saved before compact storage existed
+#   float32  4*D bytes   default; distance error ~1e-7 relative, no practical effect
+#   int8     D + 16 bytes  per-vector affine quantization: x ~= scale * q + offset
+#
+# int8 rounding error is at most scale/2 per value, i.e. (max - min) / 508.
+# For a 128-d dlib/SFace embedding that moves a distance by roughly 1e-3,
+# well below the gap between genuine and impostor scores; for histogram
+# descriptors it is a similar fraction of the smallest non-zero bin.
+# `python benchmark.py` measures size, distance error and decision agreement
+# for each mode on synthetic galleries.
+import numpy as np
+
+from lbp import chi_square_distance
+
+TEMPLATE_STORAGE = ('float64', 'float32', 'int8')
+
+
+def pack_template(encoding, storage='float32', weights=None):
+    """Template fields to store in known_faces for an averaged encoding
+
+    `weights` are the per-dimension weights of the template's distance
+    metric (None for unweighted); int8 templates cache their weighted
+    squared norm so distances can be computed without dequantizing.
+    """
+    if storage not in TEMPLATE_STORAGE:
+        raise ValueError(f"Unknown template storage '{storage}', expected one of {TEMPLATE_STORAGE}")
+
+    encoding = np.asarray(encoding, dtype=np.float64).ravel()
+    if storage != 'int8':
+        return {'encoding': encoding.astype(storage), 'storage': storage}
+
+    lo, hi = float(encoding.min()), float(encoding.max())
+    # Round the parameters to their stored precision before quantizing
+    offset = float(np.float32((hi + lo) / 2))
+    scale = float(np.float32((hi - lo) / 254)) if hi > lo else 1.0
+    q = np.clip(np.rint((encoding - offset) / scale), -127, 127).astype(np.int8)
+
+    restored = scale * q.astype(np.float64) + offset
+    w2 = 1.0 if weights is None else np.asarray(weights, dtype=np.float64) ** 2
+    return {
+        'encoding': q,
+        'storage': 'int8',
+        'scale': np.float32(scale),
+        'offset': np.float32(offset),
+        'sq_norm': np.float64(np.sum(w2 * restored ** 2)),
+    }
+
+
+def unpack_template(entry):
+    """Float32 encoding of a stored template, whatever its storage mode"""
+    encoding = entry['encoding']
+    if entry.get('storage') == 'int8':
+        return (np.float32(entry['scale']) * encoding.astype(np.float32) + np.float32(entry['offset']))
+    return np.asarray(encoding, dtype=np.float32)
+
+
+def stack_templates(entries):
+    """Stack int8 templates into (q, scale, offset, sq_norm) arrays for gallery comparison"""
+    return (
+        np.stack([e['encoding'] for e in entries]),
+        np.array([e['scale'] for e in entries], dtype=np.float64),
+        np.array([e['offset'] for e in entries], dtype=np.float64),
+        np.array([e['sq_norm'] for e in entries], dtype=np.float64),
+    )
+
+
+def quantized_distance(metric, probe, q, scale, offset, sq_norm, weights=None, cells=1):
+    """Distance from a float probe to int8 template(s) without dequantizing them
+
+    With x = scale * q + offset, the cross term expands to
+    p.x = scale * (q @ p) + offset * sum(p), and |x|^2 comes from the
+    cached sq_norm, so only one int8 matrix-vector product touches the
+    gallery. q may be (D,) with scalar parameters or (N, D) with (N,) ones.
+    """
+    probe = np.asarray(probe, dtype=np.float64).ravel()
+
+    if metric == 'chi_square':
+        # Not expressible through dot products: dequantize just for this call
+        restored = np.asarray(scale)[..., None] * q + np.asarray(offset)[..., None]
+        return chi_square_distance(probe, restored, cells=cells)
+
+    w2 = np.ones_like(probe) if weights is None else np.asarray(weights, dtype=np.float64) ** 2
+    pw = w2 * probe if metric == 'weighted_euclidean' else probe
+    cross = scale * (q @ pw) + offset * pw.sum()
+
+    if metric in ('euclidean', 'weighted_euclidean'):
+        probe_sq = np.sum(pw * probe)
+        return np.sqrt(np.maximum(probe_sq - 2 * cross + sq_norm, 0.0))
+    if metric == 'cosine':
+        norms = np.sqrt(sq_norm) * np.linalg.norm(probe)
+        return 1.0 - cross / np.maximum(norms, 1e-12)
+    raise ValueError(f"Unknown distance metric '{metric}'")
+
+
+def quantized_pairwise_distance(metric, probes, q, scale, offset, sq_norm, weights=None, cells=1):
+    """Row-wise distances from probes[i] to int8 template i, without dequantizing
+
+    q, scale, offset and sq_norm are stack_templates() arrays; the
+    expansion is the same as quantized_distance's, one row at a time.
+    """
+    probes = np.asarray(probes, dtype=np.float64)
+
+    if metric == 'chi_square':
+        restored = scale[:, None] * q + offset[:, None]
+        return chi_square_distance(probes, restored, cells=cells)
+
+    w2 = np.ones(probes.shape[-1]) if weights is None else np.asarray(weights, dtype=np.float64) ** 2
+    pw = w2 * probes if metric == 'weighted_euclidean' else probes
+    cross = scale * np.einsum('ij,ij->i', q, pw) + offset * pw.sum(axis=-1)
+
+    if metric in ('euclidean', 'weighted_euclidean'):
+        probe_sq = np.sum(pw * probes, axis=-1)
+        return np.sqrt(np.maximum(probe_sq - 2 * cross + sq_norm, 0.0))
+    if metric == 'cosine':
+        norms = np.sqrt(sq_norm) * np.linalg.norm(probes, axis=-1)
+        return 1.0 - cross / np.maximum(norms, 1e-12)
+    raise ValueError(f"Unknown distance metric '{metric}'")
@@ -0,0 +1,82 @@
+# tracking.py - Per-source face tracking so detection can skip full-frame scans
+import threading
+import time
+
+
+class FaceTracker:
+    """Remembers the last face box of one capture source
+
+    While a track is live, the next frame only needs to be searched inside
+    the last box expanded by `roi_margin` on every side. A full-frame scan
+    is forced every `redetect_interval` frames (to notice new faces), when
+    the ROI search misses, or when the last hit is older than `max_age`
+    seconds (e.g. between two separate verification requests).
+    """
+
+    def __init__(self, redetect_interval=10, roi_margin=0.5, max_age=1.0):
+        self.redetect_interval = redetect_interval
+        self.roi_margin = roi_margin
+        self.max_age = max_age
+        self.box = None
+        self.updated_at = 0.0
+        self.frames_since_full = 0
+        self.lock = threading.Lock()
+        # Metrics
+        self.frames = 0
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.roi_hits = 0
+        self.lost = 0
+
+    def search_region(self, frame_shape):
+        """(x0, y0, x1, y1) to search on this frame, or None for a full-frame scan"""
+        if self.box is None:
+            return None
+        if self.frames_since_full >= self.redetect_interval or \
+                time.monotonic() - self.updated_at > self.max_age:
+            return None
+
+        height, width = frame_shape[:2]
+        x, y, w, h = self.box
+        mx, my = int(w * self.roi_margin), int(h * self.roi_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+        if x1 - x0 <= 0 or y1 - y0 <= 0:
+            return None
+        return x0, y0, x1, y1
+
+    def update(self, faces, full_scan):
+        """Record the result of a scan; faces are full-frame (x, y, w, h) boxes"""
+        self.frames += 1
+        if full_scan:
+            self.full_scans += 1
+            self.frames_since_full = 0
+        else:
+            self.roi_scans += 1
+            self.frames_since_full += 1
+
+        if len(faces) > 0:
+            if not full_scan:
+                self.roi_hits += 1
+            # Follow the largest face
+            self.box = tuple(int(v) for v in max(faces, key=lambda f: f[2] * f[3]))
+            self.updated_at = time.monotonic()
+        else:
+            self.box = None
+
+    def miss(self):
+        """ROI search found nothing; the caller falls back to a full-frame scan"""
+        self.lost += 1
+        self.roi_scans += 1
+        self.box = None
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'full_scans': self.full_scans,
+            'roi_scans': self.roi_scans,
+            'roi_hits': self.roi_hits,
+            'lost': self.lost,
+            'detector_skip_ratio': self.roi_hits / self.frames if self.frames else 0.0,
+            'tracking': self.box is not None
+        }
@@ -52,6 +52,75 @@ import {
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:5000';
 const FACE_VERIFICATION_URL = process.env.NEXT_PUBLIC_FACE_VERIFICATION_URL || 'http://localhost:5002';
+const FACE_STREAM_DEADLINE_MS = 5000;
+
+// Streams webcam frames from this browser to the face service, which only
+// ever verifies the newest one. Resolves with the final session status, or
+// null when the browser has no camera API (caller falls back to /verify).
+// Resolves once the video has a frame that hasn't been drawn yet, so uploads
+// never exceed the camera's own rate.
+function nextVideoFrame(video, frameRate) {
+  if (typeof video.requestVideoFrameCallback === 'function') {
+    return new Promise((resolve) => video.requestVideoFrameCallback(() => resolve()));
+  }
+  return new Promise((resolve) => setTimeout(resolve, 1000 / frameRate));
+}
+
+async function streamFaceVerification(username) {
+  if (typeof navigator === 'undefined' || !navigator.mediaDevices?.getUserMedia) {
+    return null;
+  }
+
+  const stream = await navigator.mediaDevices.getUserMedia({
+    video: { width: { ideal: 640 }, height: { ideal: 480 }, facingMode: 'user' }
+  });
+  try {
+    const video = document.createElement('video');
+    video.srcObject = stream;
+    video.muted = true;
+    video.playsInline = true;
+    await video.play();
+
+    const canvas = document.createElement('canvas');
+    canvas.width = video.videoWidth || 640;
+    canvas.height = video.videoHeight || 480;
+    const context = canvas.getContext('2d');
+    const frameRate = stream.getVideoTracks()[0]?.getSettings().frameRate || 15;
+
+    let start;
+    try {
+      start = await axios.post(`${FACE_VERIFICATION_URL}/api/face/stream/start`, {
+        username,
+        deadline_ms: FACE_STREAM_DEADLINE_MS
+      });
+    } catch (error) {
+      // A JSON 404 from start means the user isn't registered (an older server 404s with HTML)
+      if (error.response?.status === 404 && error.response.data?.success === false) {
+        error.notRegistered = true;
+      }
+      throw error;
+    }
+    const sessionId = start.data.session_id;
+
+    // One upload in flight at a time, each of a new camera frame; the server
+    // drops frames it can't keep up with
+    let status = start.data;
+    while (!status.done) {
+      await nextVideoFrame(video, frameRate);
+      context.drawImage(video, 0, 0, canvas.width, canvas.height);
+      const blob = await new Promise((resolve) => canvas.toBlob(resolve, 'image/jpeg', 0.8));
+      const response = await axios.post(
+        `${FACE_VERIFICATION_URL}/api/face/stream/${sessionId}/frame`,
+        blob,
+        { headers: { 'Content-Type': 'image/jpeg' } }
+      );
+      status = response.data;
+    }
+    return status;
+  } finally {
+    stream.getTracks().forEach((track) => track.stop());
+  }
+}
 
 export default function Dashboard() {
   const [activeTab, setActiveTab] = useState('sessions');
@@ -284,13 +353,26 @@ export default function Dashboard() {
         position: 'bottom-center'
       });
 
-      const response = await axios.post(`${FACE_VERIFICATION_URL}/api/face/verify`, {
-        username
-      });
+      // Prefer this device's webcam; fall back to the server camera
+      let result = null;
+      try {
+        result = await streamFaceVerification(username);
+      } catch (streamError) {
+        if (streamError.notRegistered) {
+          throw streamError;
+        }
+        console.warn('Streaming verification unavailable, using server camera:', streamError);
+      }
+      if (!result) {
+        const response = await axios.post(`${FACE_VERIFICATION_URL}/api/face/verify`, {
+          username
+        });
+        result = response.data;
+      }
 
       setVerifyingFace(false);
       
-      if (response.data.verified) {
+      if (result.verified) {
         setVerificationStep('success');
         toast.success('Face verified successfully!', {
           position: 'bottom-center'